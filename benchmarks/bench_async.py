@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Asyncio benchmark.
+
+Reads the status of every vehicle on an account served by the local mock
+server, first serially through Connection and then concurrently through
+AsyncConnection, and checks that both return the same data.
+
+Run from the repository root (requires aiohttp):
+
+    python benchmarks/bench_async.py [vehicles] [latency_ms]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import jlrpy  # noqa: E402
+from mock_server import MockJLRServer  # noqa: E402
+
+
+def sync_sweep(server):
+    """Read every vehicle status serially"""
+    with jlrpy.Connection("user@example.com", "password", base_urls=server.base_urls) as c:
+        return [v.get_status("EV_STATE_OF_CHARGE") for v in c.vehicles]
+
+
+async def async_sweep(server, pool_maxsize):
+    """Read every vehicle status concurrently"""
+    async with jlrpy.AsyncConnection("user@example.com", "password", base_urls=server.base_urls,
+                                     pool_maxsize=pool_maxsize) as c:
+        return await asyncio.gather(*(v.get_status("EV_STATE_OF_CHARGE") for v in c.vehicles))
+
+
+def main():
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+    with MockJLRServer(latency=latency, vehicles=vehicles) as server:
+        start = time.perf_counter()
+        sync_result = sync_sweep(server)
+        print(f" sync: {vehicles} vehicles in {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        async_result = asyncio.run(async_sweep(server, pool_maxsize=50))
+        print(f"async: {vehicles} vehicles in {time.perf_counter() - start:.2f} s")
+
+    assert sync_result == list(async_result), "sync and async results differ"
+
+
+if __name__ == "__main__":
+    main()
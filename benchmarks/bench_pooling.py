@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Connection pooling benchmark.
+
+Measures the per-request latency of Vehicle.get_status against the local
+mock server with pooled keep-alive sessions and with a fresh connection
+per request.
+
+Run from the repository root:
+
+    python benchmarks/bench_pooling.py [requests]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import jlrpy  # noqa: E402
+from mock_server import MockJLRServer  # noqa: E402
+
+
+def measure(server, keep_alive, count):
+    """Return per-request latencies in milliseconds"""
+    with jlrpy.Connection("user@example.com", "password", base_urls=server.base_urls,
+                          keep_alive=keep_alive) as c:
+        v = c.vehicles[0]
+        v.get_status()  # warm up
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            v.get_status()
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with MockJLRServer() as server:
+        for label, keep_alive in (("pooled", True), ("unpooled", False)):
+            samples = measure(server, keep_alive, count)
+            print(f"{label:>9}: mean {statistics.mean(samples):.3f} ms, "
+                  f"median {statistics.median(samples):.3f} ms, "
+                  f"p95 {sorted(samples)[int(len(samples) * 0.95)]:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
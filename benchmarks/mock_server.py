@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the JLR Remote Car API.
+
+Serves the IFAS token, IFOP client registration and IF9 user, vehicle,
+status, trip and service endpoints used by jlrpy over plain HTTP on
+localhost, so the client can be exercised and benchmarked without
+touching the real backend.
+
+Latency, error injection and payload sizes are configurable:
+
+    with MockJLRServer(latency=0.02, error_rate=0.01, vehicles=100,
+                       status_keys=200, trips=500, route_points=3000) as server:
+        c = jlrpy.Connection("user@example.com", "password", base_urls=server.base_urls)
+
+Run it standalone to point other tools at it:
+
+    python benchmarks/mock_server.py [port]
+"""
+
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+VEHICLE_COMMANDS = ("chargeProfile", "preconditioning", "healthstatus", "honkBlink", "lock", "unlock",
+                    "swu", "prov", "engineOn", "engineOff")
+CHARGE_PROFILE_SETTINGS = frozenset(("departureTimerSetting", "tariffSettings"))
+
+
+class MockBaseURLs:
+    """Base URLs pointing at a local mock server"""
+
+    def __init__(self, port, host="127.0.0.1"):
+        root = f"http://{host}:{port}"
+        self.IFAS = f"{root}/ifas/jlr"
+        self.IFOP = f"{root}/ifop/jlr"
+        self.IF9 = f"{root}/if9/jlr"
+
+
+def _timestamp(value):
+    return value.strftime(TIME_FORMAT)
+
+
+class MockState:
+    """Configuration and mutable state shared by all request handlers"""
+
+    def __init__(self, latency, error_rate, vehicles, status_keys, trips, route_points, service_duration, seed):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = None
+        self.reject_combined_charge_profile = False
+        self.status_keys = status_keys
+        self.trips = trips
+        self.route_points = route_points
+        self.service_duration = service_duration
+        self.vins = [f"SADHA2B10K1{i:06d}" for i in range(vehicles)]
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.endpoint_counts = {}
+        self.services = {}
+        self.departure_timers = {}
+        self.last_updated = datetime.now(timezone.utc)
+        self.lock = threading.Lock()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.request_count += 1
+            self.endpoint_counts[endpoint] = self.endpoint_counts.get(endpoint, 0) + 1
+
+    def inject_error(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Request handler dispatching on method and path"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    routes = [
+        ("POST", r"/tokens/tokensSSO$", "tokens"),
+        ("POST", r"/users/[^/]+/clients$", "register_client"),
+        ("GET", r"/if9/jlr/users$", "user"),
+        ("POST", r"/if9/jlr/users/[^/]+$", "no_content"),
+        ("GET", r"/users/[^/]+/vehicles$", "vehicles"),
+        ("POST", r"/users/[^/]+/authenticate$", "authenticate"),
+        ("GET", r"/geocode/reverse/[^/]+/[^/]+/\w+$", "geocode"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/status$", "status"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/position$", "position"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/attributes$", "attributes"),
+        ("POST", r"/vehicles/(?P<vin>[^/]+)/attributes$", "no_content"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/departuretimers$", "departure_timers"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/wakeuptime$", "wakeup_time"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/subscriptionpackages$", "subscription_packages"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/contactinfo/\w+$", "contact_info"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/trips$", "trips"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/trips/(?P<trip_id>\d+)/route$", "route"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/services$", "services"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/services/(?P<service_id>[^/]+)$", "service_status"),
+        ("GET", r"/vehicles/(?P<vin>[^/]+)/settings/\w+$", "setting"),
+        ("POST", r"/vehicles/(?P<vin>[^/]+)/settings$", "no_content"),
+        ("POST", r"/vehicles/(?P<vin>[^/]+)/(?P<command>%s)$" % "|".join(VEHICLE_COMMANDS), "command"),
+        ("DELETE", r"/vehicles/(?P<vin>[^/]+)/gm/alarms/INSTANT$", "no_content"),
+    ]
+    compiled_routes = [(method, re.compile(pattern), name) for method, pattern, name in routes]
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _reply(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            return None
+
+    def _dispatch(self, method):
+        state = self.server.state
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.body = self._read_body()
+        for route_method, pattern, name in self.compiled_routes:
+            match = pattern.search(url.path) if route_method == method else None
+            if match:
+                break
+        else:
+            state.count("unknown")
+            return self._reply({"errorLabel": "NotFound", "errorDescription": url.path}, 404)
+
+        state.count(name)
+        if state.latency:
+            time.sleep(state.latency)
+        if state.inject_error():
+            headers = {"Retry-After": str(state.retry_after)} if state.retry_after is not None else None
+            return self._reply({"errorLabel": "ServiceUnavailable", "errorDescription": "injected"}, 503, headers)
+        return self._reply(*getattr(self, f"handle_{name}")(state, **match.groupdict()))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._dispatch("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._dispatch("POST")
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self._dispatch("DELETE")
+
+    # Handlers return (payload, status)
+
+    def handle_tokens(self, state):
+        return {"access_token": uuid.uuid4().hex, "authorization_token": uuid.uuid4().hex,
+                "expires_in": "86400", "refresh_token": uuid.uuid4().hex, "token_type": "bearer"}, 200
+
+    def handle_register_client(self, state):
+        return None, 204
+
+    def handle_no_content(self, state, **_):
+        return None, 204
+
+    def handle_user(self, state):
+        return {"userId": "user-1", "loginName": self.query.get("loginName"),
+                "contact": {"firstName": "Mock", "lastName": "User",
+                            "userPreferences": {"unitsOfMeasurement": "Km Litre Celsius"}}}, 200
+
+    def handle_vehicles(self, state):
+        return {"vehicles": [{"userId": "user-1", "vin": vin, "role": "Primary"} for vin in state.vins]}, 200
+
+    def handle_authenticate(self, state):
+        return {"token": uuid.uuid4().hex}, 200
+
+    def handle_geocode(self, state):
+        return {"formattedAddress": "Karl Johans gate 1, 0154 Oslo, Norway", "city": "Oslo"}, 200
+
+    def handle_status(self, state, vin):
+        core = [{"key": "DOOR_IS_ALL_DOORS_LOCKED", "value": "TRUE"},
+                {"key": "ODOMETER_METER", "value": "12345678"}]
+        core += [{"key": f"MOCK_STATUS_{i}", "value": str(i)} for i in range(max(state.status_keys - 5, 0))]
+        return {
+            "vehicleStatus": {
+                "coreStatus": core,
+                "evStatus": [
+                    {"key": "EV_STATE_OF_CHARGE", "value": "64"},
+                    {"key": "EV_CHARGING_STATUS", "value": "CHARGING"},
+                    {"key": "EV_CHARGING_METHOD", "value": "WIRED"},
+                ]},
+            "vehicleAlerts": [],
+            "lastUpdatedTime": _timestamp(state.last_updated)}, 200
+
+    def handle_position(self, state, vin):
+        return {"position": {"latitude": 59.9139, "longitude": 10.7522, "speed": 0, "heading": 90,
+                             "timestamp": _timestamp(datetime.now(timezone.utc))}}, 200
+
+    def handle_attributes(self, state, vin):
+        return {"nickname": "I-PACE", "registrationNumber": "EV12345", "vehicleBrand": "Jaguar",
+                "vehicleType": "X590", "modelYear": 2019}, 200
+
+    def handle_departure_timers(self, state, vin):
+        timers = state.departure_timers.get(vin, {})
+        return {"departureTimerSetting": {"timers": [timers[index] for index in sorted(timers)]}}, 200
+
+    def handle_wakeup_time(self, state, vin):
+        return {"state": "INACTIVE"}, 200
+
+    def handle_subscription_packages(self, state, vin):
+        return {"subscriptionPackages": [{"name": "ONLINE_PACK", "status": "ACTIVE"}]}, 200
+
+    def handle_contact_info(self, state, vin):
+        return {"contactInfo": [{"type": "CUSTOMER_CARE", "phoneNumber": "+4712345678"}]}, 200
+
+    def handle_setting(self, state, vin):
+        return {"key": "ClimateControlRccTargetTemp", "value": "42"}, 200
+
+    def _trip_times(self, state):
+        """Trips end every six hours, going back from now"""
+        end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        for i in range(state.trips):
+            stop = end - timedelta(hours=6 * i)
+            yield state.trips - i, stop - timedelta(minutes=30), stop
+
+    def handle_trips(self, state, vin):
+        start = datetime.strptime(self.query["startDate"], TIME_FORMAT) if "startDate" in self.query else None
+        stop = datetime.strptime(self.query["stopDate"], TIME_FORMAT) if "stopDate" in self.query else None
+        count = int(self.query.get("count", 1000))
+        trips = []
+        for trip_id, trip_start, trip_stop in self._trip_times(state):
+            if (start and trip_start < start) or (stop and trip_start >= stop):
+                continue
+            trips.append({"id": trip_id, "tripDetails": {
+                "startTime": _timestamp(trip_start), "endTime": _timestamp(trip_stop),
+                "distance": 25000, "startOdometer": 1000000 + trip_id * 25000}})
+            if len(trips) >= count:
+                break
+        return {"trips": trips}, 200
+
+    def handle_route(self, state, vin, trip_id):
+        page_size = int(self.query.get("pageSize", 1000))
+        page = int(self.query.get("page", 1))
+        first = (page - 1) * page_size
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(hours=int(trip_id))
+        waypoints = []
+        for i in range(first, min(first + page_size, state.route_points)):
+            waypoints.append({
+                "timestamp": _timestamp(start + timedelta(seconds=5 * i)),
+                "position": {"latitude": 59.9 + i * 0.0001, "longitude": 10.7 + i * 0.0001,
+                             "speed": 50.0 if i % 100 < 90 else 0.0, "heading": 45}})
+        return {"tripId": int(trip_id), "waypoints": waypoints}, 200
+
+    def _service_record(self, state, service_id):
+        created, vin, command = state.services[service_id]
+        status = "Successful" if time.monotonic() - created >= state.service_duration else "Started"
+        return {"customerServiceId": service_id, "vehicleId": vin, "serviceType": command, "status": status}
+
+    def handle_services(self, state, vin):
+        return {"services": [self._service_record(state, service_id)
+                             for service_id, (_, service_vin, _) in list(state.services.items())
+                             if service_vin == vin]}, 200
+
+    def handle_service_status(self, state, vin, service_id):
+        if service_id not in state.services:
+            return {"errorLabel": "NotFound", "errorDescription": service_id}, 404
+        return self._service_record(state, service_id), 200
+
+    def handle_command(self, state, vin, command):
+        if command == "chargeProfile" and self.body:
+            if state.reject_combined_charge_profile and len(self.body.keys() & CHARGE_PROFILE_SETTINGS) > 1:
+                return {"errorLabel": "BadRequest", "errorDescription": "one setting per request"}, 400
+            timers = state.departure_timers.setdefault(vin, {})
+            setting = self.body.get("departureTimerSetting") or {}
+            for timer in setting.get("timers", []):
+                if "departureTime" in timer:
+                    timers[timer["timerIndex"]] = timer
+                else:
+                    timers.pop(timer["timerIndex"], None)
+        if command == "healthstatus":
+            state.last_updated = datetime.now(timezone.utc)
+        service_id = uuid.uuid4().hex
+        with state.lock:
+            state.services[service_id] = (time.monotonic(), vin, command)
+        return self._service_record(state, service_id), 200
+
+
+class _ThreadingHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+class MockJLRServer:
+    """Threaded mock server. Use as a context manager or call start()/stop()
+
+    latency: seconds added to every request
+    error_rate: fraction of requests answered with a 503. Set state.retry_after to send a Retry-After with them
+    Set state.reject_combined_charge_profile to answer 400 to chargeProfile requests with several settings
+    vehicles: number of vehicles on the account
+    status_keys: number of core status keys per status response
+    trips: number of trips per vehicle
+    route_points: number of waypoints per trip route
+    service_duration: seconds before a started service reports Successful
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, vehicles=1, status_keys=5, trips=50, route_points=1500,
+                 service_duration=0.0, port=0, seed=0):
+        self.httpd = _ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.state = self.httpd.state = MockState(latency, error_rate, vehicles, status_keys, trips,
+                                                  route_points, service_duration, seed)
+        self.base_urls = MockBaseURLs(self.httpd.server_address[1])
+        self._thread = None
+
+    @property
+    def request_count(self):
+        """Number of requests served so far"""
+        return self.state.request_count
+
+    @property
+    def endpoint_counts(self):
+        """Number of requests served so far, by handler"""
+        return dict(self.state.endpoint_counts)
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    server = MockJLRServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print(f"Serving mock JLR API, IF9 base URL {server.base_urls.IF9}")
+    server.httpd.serve_forever()
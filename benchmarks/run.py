@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""jlrpy benchmark suite.
+
+Runs against the local mock server and measures:
+
+  startup   end-to-end Connection startup (login, device registration,
+            user lookup and vehicle list), and resuming from a session store
+  status    Vehicle.get_status throughput, serial and through a Fleet
+  command   command round trip including service authentication, with and
+            without the service token cache
+  memory    memory per Vehicle and per VehicleStatus
+
+Run from the repository root:
+
+    python benchmarks/run.py [--latency MS] [--iterations N] [--json FILE] [section ...]
+
+Save the --json output of a known good revision and compare it with a
+later run to spot performance regressions.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import jlrpy  # noqa: E402
+from mock_server import MockJLRServer  # noqa: E402
+
+EMAIL = "user@example.com"
+PASSWORD = "password"
+
+
+def timed(func, iterations):
+    """Call func iterations times and return latency statistics in milliseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"mean_ms": statistics.mean(samples), "median_ms": statistics.median(samples),
+            "p95_ms": samples[min(int(len(samples) * 0.95), len(samples) - 1)]}
+
+
+def bench_startup(args):
+    with MockJLRServer(latency=args.latency) as server:
+        results = {"login": timed(lambda: jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls).close(),
+                                  args.iterations)}
+        with tempfile.TemporaryDirectory() as tmp:
+            store = jlrpy.FileSessionStore(os.path.join(tmp, "session.json"))
+            jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, session_store=store).close()
+            count = server.request_count
+            results["resume"] = timed(lambda: jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls,
+                                                               session_store=store).close(), args.iterations)
+            results["resume"]["requests"] = server.request_count - count
+    return results
+
+
+def bench_status(args):
+    results = {}
+    with MockJLRServer(latency=args.latency, vehicles=args.vehicles) as server:
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, pool_maxsize=args.workers) as c:
+            vehicle = c.vehicles[0]
+            serial = timed(vehicle.get_status, args.iterations)
+            serial["requests_per_s"] = 1000 / serial["mean_ms"]
+            results["serial"] = serial
+
+            fleet = jlrpy.Fleet([c], max_workers=args.workers)
+            start = time.perf_counter()
+            errors = sum(result.error is not None for result in fleet.poll_status())
+            elapsed = time.perf_counter() - start
+            results["fleet"] = {"vehicles": len(c.vehicles), "seconds": elapsed, "errors": errors,
+                                "requests_per_s": len(c.vehicles) / elapsed}
+    return results
+
+
+def bench_command(args):
+    results = {}
+    with MockJLRServer(latency=args.latency) as server:
+        for label, ttl in (("uncached", 0), ("cached", 300)):
+            with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, service_token_ttl=ttl) as c:
+                vehicle = c.vehicles[0]
+                count = server.request_count
+                results[label] = timed(vehicle.charging_start, args.iterations)
+                results[label]["requests_per_command"] = (server.request_count - count) / args.iterations
+    return results
+
+
+def bench_memory(args):
+    count = 1000
+    with MockJLRServer() as server:
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls) as c:
+            data = dict(c.vehicles[0])
+            status = c.vehicles[0].get_status()
+
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            vehicles = [jlrpy.Vehicle(dict(data, vin=f"{data['vin'][:11]}{i:06d}"), c) for i in range(count)]
+            after = tracemalloc.take_snapshot()
+            per_vehicle = sum(stat.size_diff for stat in after.compare_to(before, "filename")) / count
+
+            before = tracemalloc.take_snapshot()
+            statuses = [jlrpy.VehicleStatus(json.loads(json.dumps(status))) for _ in range(count)]
+            after = tracemalloc.take_snapshot()
+            per_status = sum(stat.size_diff for stat in after.compare_to(before, "filename")) / count
+            tracemalloc.stop()
+            del vehicles, statuses
+    return {"vehicle_bytes": per_vehicle, "vehicle_status_bytes": per_status}
+
+
+SECTIONS = {
+    "startup": bench_startup,
+    "status": bench_status,
+    "command": bench_command,
+    "memory": bench_memory,
+}
+
+
+def report(results, indent=0):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f"{' ' * indent}{key}:")
+            report(value, indent + 2)
+        elif isinstance(value, float):
+            print(f"{' ' * indent}{key}: {value:.3f}")
+        else:
+            print(f"{' ' * indent}{key}: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sections", nargs="*", metavar="section",
+                        help=f"sections to run ({', '.join(SECTIONS)}), all by default")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server latency in milliseconds")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--vehicles", type=int, default=200, help="vehicles on the account for the fleet sweep")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+    args.latency /= 1000
+    unknown = set(args.sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown sections: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in args.sections or SECTIONS:
+        results[name] = SECTIONS[name](args)
+        print(f"{name}:")
+        report(results[name], 2)
+
+    if args.json:
+        with open(args.json, "w", encoding="UTF-8") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
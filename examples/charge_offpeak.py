@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 """Charge Off-Peak script.
 
-This script will check the charging level once every minute
-if the vehicle is at home (100 meters or less from the location
+This script will check the charging level once every minute while
+charging (every five minutes otherwise) if the vehicle is at home (100 meters or less from the location
 specified in the config file) and if the current battery level
 meets or exceeds the specified maximum value, the charging will
 stop if the vehicle is currently charging.
@@ -12,9 +12,7 @@ If the vehicle is charging during off-peak hours, the charging will stop.
 """
 
 import jlrpy
-import threading
 import datetime
-import math
 from datetime import date
 import os
 import configparser
@@ -27,54 +25,14 @@ import configparser
 
 logger = jlrpy.logger
 
-def distance(origin, destination):
+def check_soc(v, status):
+    """Stop or start charging if current charging level matches or
+    exceeds specified max level and the vehicle is currently charging.
     """
-    From https://stackoverflow.com/questions/19412462
-
-    Calculate the Haversine distance.
-
-    Parameters
-    ----------
-    origin : tuple of float
-        (lat, long)
-    destination : tuple of float
-        (lat, long)
-
-    Returns
-    -------
-    distance_in_km : float
-
-    Examples
-    --------
-    >>> origin = (48.1372, 11.5756)  # Munich
-    >>> destination = (52.5186, 13.4083)  # Berlin
-    >>> round(distance(origin, destination), 1)
-    504.2
-    """
-    lat1, lon1 = origin
-    lat2, lon2 = destination
-    radius = 6371  # km
-
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = (math.sin(dlat / 2) * math.sin(dlat / 2) +
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-         math.sin(dlon / 2) * math.sin(dlon / 2))
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    d = radius * c
-    return d
-
-def check_soc():
-    """Retrieve vehicle status and stop or start charging if
-    current charging level matches or exceeds specified max level and
-    the vehicle is currently charging.
-    """
-    threading.Timer(60.0, check_soc).start()  # Called every minute
-
     p = v.get_position()
     position = (p['position']['latitude'], p['position']['longitude'])
-    d = int(1000*distance(home,position))
-    if (d > 100):
+    if not home_fence.contains(*position):
+        d = int(jlrpy.haversine(home, position))
         logger.info("car is "+str(d)+"m from home")
         return
 
@@ -84,12 +42,14 @@ def check_soc():
     today = date.weekday(t)
     offpeak = ( (t.hour <  peak[today][0] or t.hour >= peak[today][1]))
 
-    # getting health status forces a status update
-    healthstatus = v.get_health_status()
-    vehicleStatus = v.get_status()['vehicleStatus']
-    status = { d['key'] : d['value'] for d in vehicleStatus['evStatus'] }
+    # only wake the car for a status update when the last one is over 5 minutes old
+    if status.is_stale(300):
+        status = v.refresh_status(max_age=300)
 
-    current_soc = int(status['EV_STATE_OF_CHARGE'])
+    current_soc = status.get_int('EV_STATE_OF_CHARGE')
+    if current_soc is None:
+        logger.info("no SoC reported, skipping")
+        return
     charging_status = status['EV_CHARGING_STATUS']
     logger.info("current SoC is "+str(current_soc)+"%"+", offpeak is "+str(offpeak))
 
@@ -118,6 +78,7 @@ config.read(configfile)
 username = config['jlrpy']['email']
 password = config['jlrpy']['password']
 home = (float(config['jlrpy']['home_latitude']), float(config['jlrpy']['home_longitude']))
+home_fence = jlrpy.CircleFence("home", home[0], home[1], 100)
 max_soc = int(config['jlrpy']['max_soc'])
 
 peak = [ [int(config['jlrpy']['peak_start_mon']),int(config['jlrpy']['peak_end_mon'])],
@@ -132,4 +93,7 @@ c = jlrpy.Connection(username, password)
 v = c.vehicles[0]
 
 logger.info("[*] Enforcing offpeak charging to max soc of %d%%" % max_soc)
-check_soc()
+scheduler = jlrpy.Scheduler(max_workers=1)
+# Called every minute while charging, every five minutes otherwise
+scheduler.add_status_job(v, check_soc, active_interval=60, idle_interval=300, delay=0)
+scheduler.run()
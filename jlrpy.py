@@ -3,16 +3,48 @@ https://github.com/ardevd/jlrpy
 """
 
 
+import array
+import asyncio
+import bisect
 import calendar
+import contextlib
+import contextvars
+import copy
+import gzip
+import hashlib
+import heapq
+import itertools
 import json
 import logging
+import math
+import os
+import random
+import sqlite3
+import sys
+import threading
 import time
 import uuid
-from datetime import datetime
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed
+from concurrent.futures import wait as wait_futures
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
 logger = logging.getLogger('jlrpy')
 
 
@@ -31,6 +63,992 @@ class ChinaBaseURLs:
 
 
 TIMEOUT = 15
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+SERVICE_TOKEN_TTL = 60
+FLEET_WORKERS = 32
+SCHEDULER_WORKERS = 16
+SCHEDULER_JITTER = 0.1
+RETRIES = 2
+RETRY_BACKOFF = 0.5
+RETRY_MAX_BACKOFF = 10
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET = 30
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+# Default client side rate limits as (requests per second, burst), per account and per request class
+RATE_LIMITS = {
+    "account": (2.0, 20),
+    "read": (2.0, 20),
+    "wakeup": (1 / 60, 2),
+    "command": (0.2, 5),
+}
+TOKEN_REFRESH_SKEW = 300
+TOKEN_REFRESH_RETRY = 30
+TRIP_PAGE_SIZE = 100
+ROUTE_PAGE_SIZE = 1000
+ROUTE_WORKERS = 8
+EARTH_RADIUS = 6371000  # metres
+GEOFENCE_CELL_SIZE = 0.05  # degrees
+# Service status polling: the interval grows with the age of the wait, SERVICE_POLL_BACKOFF
+# seconds per second waited, between SERVICE_POLL_MIN and SERVICE_POLL_MAX
+SERVICE_TIMEOUT = 120
+SERVICE_POLL_MIN = 1.0
+SERVICE_POLL_MAX = 15.0
+SERVICE_POLL_BACKOFF = 0.5
+SERVICE_TERMINAL_STATES = frozenset(("Successful", "Failed", "Cancelled"))
+PIPELINE_WORKERS = 4
+STATUS_MAX_AGE = 300
+# Services authenticated with an empty PIN or the last four digits of the VIN instead of the user PIN
+EMPTY_PIN_SERVICES = frozenset(("VHS", "SWU"))
+VIN_PIN_SERVICES = frozenset(("HBLF", "ECC", "CP"))
+PIN_PROTECTED_SERVICES = frozenset(("RDL", "RDU", "ALOFF", "REON", "REOFF", "PROV", "GM"))
+# Statuses of a combined timers and tariffs chargeProfile request that make it fall back to one request each
+CHARGE_PROFILE_REJECTED_STATUSES = frozenset((400, 422))
+
+# Seconds a cached GET response stays valid, by endpoint
+DEFAULT_CACHE_TTLS = {
+    "attributes": 3600,
+    "subscriptionpackages": 3600,
+    "contactinfo": 86400,
+    "departuretimers": 300,
+    "wakeuptime": 300,
+}
+# Cached endpoints invalidated by a write command on the same vehicle
+CACHE_INVALIDATIONS = {
+    "attributes": ("attributes",),
+    "chargeProfile": ("departuretimers",),
+    "swu": ("wakeuptime",),
+}
+
+
+class APIError(requests.RequestException):
+    """Request to the JLR API failed
+
+    status_code is the HTTP status code, or None if no response was received.
+    latency is the time in seconds the failed attempt took.
+    """
+
+    def __init__(self, message, status_code=None, url=None, latency=None, response=None):
+        super().__init__(message, response=response)
+        self.status_code = status_code
+        self.url = url
+        self.latency = latency
+
+
+class APIStatusError(APIError, HTTPError):
+    """The JLR API responded with an HTTP error status"""
+
+
+class APIConnectionError(APIError):
+    """No response was received from the JLR API (connection error or timeout)"""
+
+
+class CircuitOpenError(APIError):
+    """Request refused without being sent because the circuit breaker of its host is open"""
+
+
+class ServiceTimeoutError(APIError):
+    """A vehicle service did not reach a terminal state in time. status is its last known service status"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class RetryPolicy:
+    """Retries for idempotent GET requests with capped exponential backoff and full jitter
+
+    Connection errors and the HTTP statuses in statuses are retried up to retries times.
+    A Retry-After header is honoured if it asks for a longer wait.
+    """
+
+    def __init__(self, retries=RETRIES, backoff=RETRY_BACKOFF, max_backoff=RETRY_MAX_BACKOFF,
+                 statuses=RETRY_STATUSES):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+
+    def should_retry(self, method, error, attempt):
+        """Whether the failed attempt (0 based) of a request should be retried"""
+        if method != "GET" or attempt >= self.retries or isinstance(error, CircuitOpenError):
+            return False
+        return isinstance(error, APIConnectionError) or error.status_code in self.statuses
+
+    def delay(self, attempt, error=None):
+        """Seconds to wait before retrying after the failed attempt"""
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(int(retry_after), self.max_backoff))
+        return delay
+
+
+class CircuitBreaker:
+    """Circuit breaker for one API host
+
+    Opens after failure_threshold consecutive failures (connection errors and 5xx/429 responses)
+    and refuses requests until reset_timeout seconds have passed. A single trial request is then
+    let through: success closes the circuit, failure opens it again, and a trial that failed
+    locally, without telling anything about the host, is released for the next request.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=CIRCUIT_BREAKER_THRESHOLD, reset_timeout=CIRCUIT_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may be sent now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state != self.CLOSED and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # A half-open trial that never reported back is given up after reset_timeout
+                self.state = self.HALF_OPEN
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        """Record a request that reached a healthy host"""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """Record a failed request"""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit breaker opened after %d failures", self.failures)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Record a request that failed before reaching the host. Lets the next request be the trial"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+
+def _request_class(method, url):
+    """Rate limit class of a request: auth, wakeup, read or command"""
+    path = urlsplit(url).path
+    if path.endswith(("/tokens/tokensSSO", "/clients", "/authenticate")) or path.endswith("/users"):
+        return "auth"
+    if path.endswith("/healthstatus"):
+        return "wakeup"
+    if method == "GET":
+        return "read"
+    return "command"
+
+
+class MemoryRateLimitBackend:
+    """Token buckets held in process memory"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, rate, capacity):
+        """Take a token from bucket key and return the seconds to wait until it is available"""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate) - 1
+            self._buckets[key] = (tokens, now)
+        return -tokens / rate if tokens < 0 else 0.0
+
+
+class SqliteRateLimitBackend:
+    """Token buckets in a sqlite database, shared by every process using the same file"""
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=TIMEOUT, isolation_level=None)
+
+    def reserve(self, key, rate, capacity):
+        """Take a token from bucket key and return the seconds to wait until it is available"""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(now - updated, 0) * rate) - 1
+            db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        return -tokens / rate if tokens < 0 else 0.0
+
+
+class RateLimiter:
+    """Client side token bucket rate limiter
+
+    Every request takes a token from the bucket of its account and from the bucket of its request
+    class (read, wakeup for health status requests, command, auth) and waits until both are
+    available. limits maps "account" and the request classes to (requests per second, burst);
+    classes without a limit are only subject to the account limit. Share one limiter between
+    connections, or use a SqliteRateLimitBackend to share the budget between processes.
+    """
+
+    def __init__(self, limits=None, backend=None):
+        self.limits = dict(RATE_LIMITS if limits is None else limits)
+        for name, limit in self.limits.items():
+            if limit and limit[0] <= 0:
+                raise ValueError(f"Rate limit {name} must allow more than 0 requests per second")
+        self.backend = backend or MemoryRateLimitBackend()
+
+    def reserve(self, account, request_class):
+        """Reserve a request slot and return the seconds to wait before sending it"""
+        wait = 0.0
+        for name, key in (("account", account), (request_class, f"{account}:{request_class}")):
+            limit = self.limits.get(name)
+            if limit:
+                wait = max(wait, self.backend.reserve(key, *limit))
+        return wait
+
+    def acquire(self, account, request_class):
+        """Block until a request may be sent. Returns the seconds waited"""
+        wait = self.reserve(account, request_class)
+        if wait > 0:
+            logger.debug("Rate limited %s request for %s, waiting %.2fs", request_class, account, wait)
+            time.sleep(wait)
+        return wait
+
+
+def _endpoint_name(url):
+    """Logical endpoint of an API url, e.g. status for .../vehicles/{vin}/status?includeInactive=true"""
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+    if not parts:
+        return ""
+    if parts[-1] in ("authenticate", "tokensSSO", "clients"):
+        return parts[-1]
+    if "geocode" in parts:
+        return "geocode"
+    if "vehicles" in parts:
+        rest = parts[parts.index("vehicles") + 2:]
+        if not rest:
+            return "vehicles"
+        if rest[0] == "trips" and rest[-1] == "route":
+            return "route"
+        return rest[0]
+    if "users" in parts:
+        return "users"
+    return parts[-1]
+
+
+class _Stats:
+    __slots__ = ('count', 'errors', 'bytes_sent', 'bytes_received', 'latency_sum', 'buckets')
+
+    def __init__(self, buckets):
+        self.count = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(buckets) + 1)
+
+    def snapshot(self, bounds):
+        cumulative = list(itertools.accumulate(self.buckets))
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "error_rate": self.errors / self.count if self.count else 0.0,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "latency_sum": self.latency_sum,
+            "latency_avg": self.latency_sum / self.count if self.count else 0.0,
+            "buckets": dict(zip([*bounds, float("inf")], cumulative))}
+
+
+class Metrics:
+    """Per endpoint request statistics
+
+    Records request counts, errors, bytes transferred and latency histograms for every logical
+    endpoint (status, position, chargeProfile, authenticate, tokensSSO, ...), and the time spent
+    in client phases such as login, token_refresh and service_auth separately. Span callbacks
+    are called as callback(name, start, duration, attributes) for every request and phase,
+    with start in epoch seconds.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._phases = {}
+        self._span_callbacks = []
+        self._lock = threading.Lock()
+
+    def add_span_callback(self, callback):
+        """Register callback(name, start, duration, attributes)"""
+        self._span_callbacks.append(callback)
+
+    def _observe(self, table, name, latency, error, bytes_sent=0, bytes_received=0):
+        with self._lock:
+            stats = table.get(name)
+            if stats is None:
+                stats = table[name] = _Stats(self.buckets)
+            stats.count += 1
+            stats.errors += bool(error)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latency_sum += latency
+            stats.buckets[bisect.bisect_left(self.buckets, latency)] += 1
+
+    def _emit(self, name, latency, attributes):
+        for callback in self._span_callbacks:
+            try:
+                callback(name, time.time() - latency, latency, attributes)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Span callback failed")
+
+    def record_request(self, method, url, latency, status_code=None, bytes_sent=0, bytes_received=0, error=None):
+        """Record one request attempt"""
+        endpoint = _endpoint_name(url)
+        self._observe(self._endpoints, endpoint, latency, error, bytes_sent, bytes_received)
+        if self._span_callbacks:
+            self._emit(f"jlrpy.{endpoint}", latency, {"http.method": method, "http.url": url,
+                                                       "http.status_code": status_code, "error": error is not None})
+
+    @contextlib.contextmanager
+    def span(self, phase, **attributes):
+        """Time a client phase such as token_refresh or service_auth"""
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as err:
+            error = err
+            raise
+        finally:
+            latency = time.monotonic() - start
+            self._observe(self._phases, phase, latency, error)
+            if self._span_callbacks:
+                self._emit(f"jlrpy.{phase}", latency, dict(attributes, error=error is not None))
+
+    def snapshot(self):
+        """Statistics per endpoint and per phase"""
+        with self._lock:
+            return {
+                "endpoints": {name: stats.snapshot(self.buckets) for name, stats in self._endpoints.items()},
+                "phases": {name: stats.snapshot(self.buckets) for name, stats in self._phases.items()}}
+
+    def reset(self):
+        """Clear all statistics"""
+        with self._lock:
+            self._endpoints.clear()
+            self._phases.clear()
+
+    def to_prometheus(self, prefix="jlrpy"):
+        """Statistics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            lines.extend(f"{prefix}_{sample}" for sample in samples)
+
+        def histogram(name, label, table):
+            samples = []
+            for key, stats in sorted(table.items()):
+                for bound, count in stats["buckets"].items():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    samples.append(f'{name}_bucket{{{label}="{key}",le="{le}"}} {count}')
+                samples.append(f'{name}_sum{{{label}="{key}"}} {stats["latency_sum"]}')
+                samples.append(f'{name}_count{{{label}="{key}"}} {stats["count"]}')
+            return samples
+
+        endpoints = snapshot["endpoints"]
+        metric("requests_total", "counter", "Requests sent to the JLR API",
+               [f'requests_total{{endpoint="{k}"}} {v["count"]}' for k, v in sorted(endpoints.items())])
+        metric("request_errors_total", "counter", "Failed requests",
+               [f'request_errors_total{{endpoint="{k}"}} {v["errors"]}' for k, v in sorted(endpoints.items())])
+        metric("request_bytes_total", "counter", "Bytes transferred",
+               [f'request_bytes_total{{endpoint="{k}",direction="{d}"}} {v["bytes_" + d]}'
+                for k, v in sorted(endpoints.items()) for d in ("sent", "received")])
+        metric("request_duration_seconds", "histogram", "Request latency",
+               histogram("request_duration_seconds", "endpoint", endpoints))
+        metric("phase_duration_seconds", "histogram", "Time spent in client phases",
+               histogram("phase_duration_seconds", "phase", snapshot["phases"]))
+        return "\n".join(lines) + "\n"
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _is_host_failure(error):
+    return isinstance(error, APIConnectionError) or error.status_code == 429 or error.status_code >= 500
+
+
+def _parse_body(text):
+    if text:
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+    return None
+
+
+def _endpoint(command):
+    """Logical endpoint of a command, e.g. contactinfo for contactinfo/310"""
+    return command.split("?", 1)[0].split("/", 1)[0]
+
+
+class ResponseCache:
+    """Bounded LRU cache of GET responses with a TTL per endpoint
+
+    Only endpoints with a TTL in ttls are cached. Write commands listed in invalidations
+    drop the cached responses of the matching endpoints on the same vehicle.
+    """
+
+    def __init__(self, ttls=None, maxsize=1024, invalidations=None):
+        self.ttls = dict(DEFAULT_CACHE_TTLS if ttls is None else ttls)
+        self.invalidations = dict(CACHE_INVALIDATIONS if invalidations is None else invalidations)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return a copy of the cached response for key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key, endpoint, value):
+        """Cache value for key for the TTL of endpoint"""
+        ttl = self.ttls.get(endpoint)
+        if not ttl or value is None:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url, command):
+        """Drop the entries made stale by sending command to url"""
+        prefixes = tuple(f"{url}/{endpoint}" for endpoint in self.invalidations.get(_endpoint(command), ()))
+        if not prefixes:
+            return
+        with self._lock:
+            for key in [key for key in self._entries if key[0].startswith(prefixes)]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class GeocodeCache:
+    """LRU cache of reverse geocode results by quantized position
+
+    Positions are rounded to precision decimal places (4 is about 11 metres) and all positions
+    in the same cell share one result. With a path, results are also persisted in a sqlite
+    database and survive restarts; addresses do not expire.
+    """
+
+    def __init__(self, precision=4, maxsize=10000, path=None):
+        self.precision = precision
+        self.maxsize = maxsize
+        self.path = os.path.expanduser(path) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path:
+            with self._connect() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS geocode (cell TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=TIMEOUT)
+
+    def cell(self, lat, lon):
+        """Return the key of the cell containing a position"""
+        return f"{round(float(lat), self.precision)}/{round(float(lon), self.precision)}"
+
+    def _remember(self, cell, value):
+        self._entries[cell] = value
+        self._entries.move_to_end(cell)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, lat, lon):
+        """Return a copy of the cached result for the cell of a position or None"""
+        cell = self.cell(lat, lon)
+        with self._lock:
+            value = self._entries.get(cell)
+            if value is not None:
+                self._entries.move_to_end(cell)
+        if value is None and self.path:
+            with self._connect() as db:
+                row = db.execute("SELECT data FROM geocode WHERE cell = ?", (cell,)).fetchone()
+            if row:
+                value = json.loads(row[0])
+                with self._lock:
+                    self._remember(cell, value)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def put(self, lat, lon, value):
+        """Cache value for the cell of a position"""
+        if value is None:
+            return
+        cell = self.cell(lat, lon)
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._remember(cell, value)
+        if self.path:
+            with self._connect() as db:
+                db.execute("INSERT OR REPLACE INTO geocode (cell, data) VALUES (?, ?)", (cell, json.dumps(value)))
+
+    def clear(self):
+        """Drop all entries, including persisted ones"""
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            with self._connect() as db:
+                db.execute("DELETE FROM geocode")
+
+    def stats(self):
+        """Hit/miss counters and current in-memory size"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _SingleFlight:
+    """Runs one call per key at a time. Concurrent callers with the same key share its outcome
+
+    The caller running the call gets its result; if others waited for it, each of them gets a
+    copy of a snapshot taken before they are woken, so no caller sees another modify its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Call func, or wait for the in-flight call with the same key and return a copy of its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            with self._lock:
+                call.waiters -= 1
+                last = call.waiters == 0
+            # The last follower takes the snapshot itself, so followers make one copy each in total
+            return call.result if last else copy.deepcopy(call.result)
+        try:
+            result = func()
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            try:
+                if waiters and call.error is None:
+                    call.result = copy.deepcopy(result)
+            finally:
+                call.done.set()
+        return result
+
+
+class _AsyncCall:
+    __slots__ = ('task', 'result', 'waiters')
+
+    def __init__(self):
+        self.task = None
+        self.result = None
+        self.waiters = 0
+
+
+class _AsyncSingleFlight:
+    """Asyncio counterpart of _SingleFlight"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func):
+        """Await func(), or the in-flight call with the same key and return a copy of its result
+
+        The call runs in its own task, so cancelling any one caller, including the one that
+        started it, does not cancel it for the others.
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            call.waiters += 1
+            try:
+                await asyncio.shield(call.task)
+            finally:
+                call.waiters -= 1
+            return call.result if call.waiters == 0 else copy.deepcopy(call.result)
+        call = self._calls[key] = _AsyncCall()
+        call.task = asyncio.ensure_future(self._run(key, call, func))
+        call.task.add_done_callback(lambda task: self._forget(key, call))
+        return await asyncio.shield(call.task)
+
+    async def _run(self, key, call, func):
+        """Return the result of func(), leaving a snapshot of it in call for any waiting callers"""
+        try:
+            result = await func()
+        finally:
+            self._forget(key, call)
+        if call.waiters:
+            call.result = copy.deepcopy(result)
+        return result
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if call.task.done() and not call.task.cancelled():
+            call.task.exception()  # mark retrieved when every caller was cancelled
+
+
+class TransportResponse:
+    """Response returned by a transport"""
+
+    __slots__ = ('status_code', 'text', 'headers', 'bytes_sent', 'bytes_received')
+
+    def __init__(self, status_code, text, headers=None, bytes_sent=0, bytes_received=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers if headers is not None else {}
+        self.bytes_sent = bytes_sent
+        self.bytes_received = len(text.encode()) if bytes_received is None else bytes_received
+
+
+class HTTPTransport:
+    """Sends requests through one pooled keep-alive requests.Session per host
+
+    Transports implement send(method, url, headers, data, timeout) returning a TransportResponse
+    and close(). They raise requests.ConnectionError or requests.Timeout when no response is
+    received.
+    """
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, keep_alive=True):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self._sessions: dict = {}
+        self._sessions_lock = threading.Lock()
+
+    def _session(self, url):
+        """Return the pooled HTTP session for the host serving url"""
+        host = _host(url)
+        with self._sessions_lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                      pool_maxsize=self.pool_maxsize)
+                session.mount(f"{urlsplit(host).scheme}://", adapter)
+                self._sessions[host] = session
+        return session
+
+    def send(self, method, url, headers, data, timeout):
+        """Send a request and return its TransportResponse"""
+        if self.keep_alive:
+            ret = self._session(url).request(method=method, url=url, headers=headers, json=data, timeout=timeout)
+        else:
+            ret = requests.request(method=method, url=url, headers=headers, json=data, timeout=timeout)
+        return TransportResponse(ret.status_code, ret.text, ret.headers, len(ret.request.body or b""),
+                                 len(ret.content))
+
+    def close(self):
+        """Close all pooled HTTP sessions"""
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+def _open_log(path, mode):
+    path = os.path.expanduser(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding='UTF-8')
+    return open(path, mode, encoding='UTF-8')
+
+
+class RecordingTransport:
+    """Transport appending every request/response pair to a JSONL log (gzip compressed if it ends in .gz)
+
+    Each line holds the method, URL, Accept header, status, response body, the offset from the
+    first request and the latency in seconds. Request bodies are not recorded, but responses
+    such as tokensSSO contain credentials, so keep logs private.
+    """
+
+    def __init__(self, path, transport=None):
+        self.transport = transport or HTTPTransport()
+        self._log = _open_log(path, "a")
+        self._lock = threading.Lock()
+        self._started = None
+
+    def send(self, method, url, headers, data, timeout):
+        """Send through the wrapped transport and record the exchange"""
+        start = time.monotonic()
+        ret = self.transport.send(method, url, headers, data, timeout)
+        elapsed = time.monotonic() - start
+        record = {"method": method, "url": url, "accept": (headers or {}).get("Accept"),
+                  "status": ret.status_code, "body": ret.text, "elapsed": round(elapsed, 6)}
+        if ret.headers.get("Retry-After"):
+            record["retry_after"] = ret.headers["Retry-After"]
+        with self._lock:
+            if self._started is None:
+                self._started = start
+            record["offset"] = round(start - self._started, 6)
+            self._log.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._log.flush()
+        return ret
+
+    def close(self):
+        """Close the log and the wrapped transport"""
+        with self._lock:
+            self._log.close()
+        self.transport.close()
+
+
+class ReplayTransport:
+    """Transport serving responses from a RecordingTransport log without network access
+
+    Responses are matched on method, URL path and query and Accept header and served in recorded
+    order; once the responses for a request are used up the last one is repeated. With speed
+    set, every response is delayed by its recorded latency divided by speed and not served
+    before its recorded offset divided by speed, reproducing the recorded load pattern
+    (speed=1 for real time, 10 for ten times faster). A request that was never recorded raises
+    requests.ConnectionError.
+    """
+
+    def __init__(self, path, speed=None):
+        self.speed = speed
+        self.records = []
+        self._responses = {}
+        with _open_log(path, "r") as log:
+            for line in log:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records.append(record)
+                    key = self._key(record["method"], record["url"], record["accept"])
+                    self._responses.setdefault(key, []).append(record)
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._started = None
+
+    @staticmethod
+    def _key(method, url, accept):
+        parts = urlsplit(url)
+        return method, parts.path, parts.query, accept
+
+    def send(self, method, url, headers, data, timeout):
+        """Return the next recorded response for the request"""
+        key = self._key(method, url, (headers or {}).get("Accept"))
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                raise requests.ConnectionError(f"No recorded response for {method} {url}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = min(position + 1, len(responses) - 1)
+            if self._started is None:
+                self._started = time.monotonic()
+            record = responses[position]
+        if self.speed:
+            wait = max(record.get("offset", 0) / self.speed - (time.monotonic() - self._started), 0)
+            time.sleep(wait + record.get("elapsed", 0) / self.speed)
+        headers = {"Retry-After": record["retry_after"]} if "retry_after" in record else {}
+        return TransportResponse(record["status"], record["body"], headers)
+
+    def close(self):
+        """Nothing to release"""
+
+
+class SessionStore:
+    """Base class for persisting connection sessions between runs
+
+    A session holds the tokens, their expiry, the user and device id and the vehicle list
+    so a new Connection can resume without logging in again.
+    """
+
+    def load(self, key):
+        """Return the session stored under key or None"""
+        raise NotImplementedError
+
+    def save(self, key, session):
+        """Store session under key"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove the session stored under key"""
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    """Session store backed by a JSON file readable only by the current user"""
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='UTF-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, sessions):
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding='UTF-8') as fh:
+            json.dump(sessions, fh)
+        os.replace(tmp_path, self.path)
+
+    def load(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def save(self, key, session):
+        with self._lock:
+            sessions = self._read()
+            sessions[key] = session
+            self._write(sessions)
+
+    def delete(self, key):
+        with self._lock:
+            sessions = self._read()
+            if sessions.pop(key, None) is not None:
+                self._write(sessions)
+
+
+class SqliteSessionStore(SessionStore):
+    """Session store backed by a sqlite database readable only by the current user"""
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        # Create the file up front so it never exists with the default umask. sqlite gives
+        # its journal files the permissions of the database
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=TIMEOUT)
+
+    def load(self, key):
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM sessions WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, key, session):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO sessions (key, data) VALUES (?, ?)", (key, json.dumps(session)))
+
+    def delete(self, key):
+        with self._connect() as db:
+            db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+
+class RouteStore:
+    """Immutable trip route cache backed by a sqlite database
+
+    Routes are stored zlib compressed under the SHA-256 digest of their content, so identical
+    routes are only stored once, and indexed by VIN and trip id. Only finished trips should be
+    stored since cached routes are never refetched.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS routes "
+                       "(vin TEXT, trip_id TEXT, digest TEXT NOT NULL, PRIMARY KEY (vin, trip_id))")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=TIMEOUT)
+
+    def get(self, vin, trip_id):
+        """Return the stored route of a trip or None"""
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM routes JOIN blobs USING (digest) WHERE vin = ? AND trip_id = ?",
+                             (vin, str(trip_id))).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def put(self, vin, trip_id, route):
+        """Store the route of a trip"""
+        data = zlib.compress(json.dumps(route, sort_keys=True, separators=(",", ":")).encode())
+        digest = hashlib.sha256(data).hexdigest()
+        with self._connect() as db:
+            db.execute("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)", (digest, data))
+            db.execute("INSERT OR REPLACE INTO routes (vin, trip_id, digest) VALUES (?, ?, ?)",
+                       (vin, str(trip_id), digest))
+
+    def cached(self, vin, trip_ids):
+        """Return the ids, as strings, of the given trips with a stored route"""
+        trip_ids = [str(trip_id) for trip_id in trip_ids]
+        found = set()
+        with self._connect() as db:
+            for i in range(0, len(trip_ids), 500):
+                chunk = trip_ids[i:i + 500]
+                found.update(row[0] for row in db.execute(
+                    f"SELECT trip_id FROM routes WHERE vin = ? AND trip_id IN ({','.join('?' * len(chunk))})",
+                    [vin, *chunk]))
+        return found
 
 
 class Connection:
@@ -41,23 +1059,97 @@ class Connection:
                  password='',
                  device_id='',
                  refresh_token='',
-                 use_china_servers=False):
+                 use_china_servers=False,
+                 base_urls=None,
+                 pool_connections=POOL_CONNECTIONS,
+                 pool_maxsize=POOL_MAXSIZE,
+                 keep_alive=True,
+                 service_token_ttl=SERVICE_TOKEN_TTL,
+                 cache_pin_services=False,
+                 token_refresh_skew=TOKEN_REFRESH_SKEW,
+                 session_store=None,
+                 lazy=False,
+                 response_cache=None,
+                 coalesce_requests=True,
+                 retry_policy=None,
+                 circuit_breaker_threshold=CIRCUIT_BREAKER_THRESHOLD,
+                 circuit_breaker_reset=CIRCUIT_BREAKER_RESET,
+                 rate_limiter=None,
+                 metrics=None,
+                 transport=None,
+                 route_store=None,
+                 geocode_cache=None):
         """Init the connection object
 
         The email address and password associated with your Jaguar InControl account is required.
         A device Id can optionally be specified. If not one will be generated at runtime.
         A refresh token can be supplied for authentication instead of a password
+
+        Requests are sent through one pooled keep-alive HTTP session per base host.
+        pool_maxsize bounds the number of sockets kept open per host and should be at least
+        the number of threads sharing the connection. Set keep_alive to False to open a
+        fresh connection for every request. base_urls overrides the IFAS/IFOP/IF9 endpoints.
+        A custom transport (e.g. RecordingTransport or ReplayTransport) replaces the default
+        HTTPTransport built from these settings.
+
+        With a RouteStore as route_store, trip routes are fetched once and then served from disk.
+        A GeocodeCache as geocode_cache serves reverse_geocode lookups of nearby positions locally.
+
+        Service authentication tokens are cached per vehicle for service_token_ttl seconds
+        (0 disables caching). Tokens for PIN protected services are only cached when
+        cache_pin_services is set.
+
+        Tokens are refreshed token_refresh_skew seconds before they expire. Only one thread
+        refreshes at a time while the others wait for its result.
+
+        A SessionStore persists the tokens, user and device id and vehicle list so later
+        connections resume without any requests while the tokens are valid. With lazy set,
+        authentication and the vehicle list are deferred until they are first needed.
+
+        Pass a ResponseCache (or True for the default policies) as response_cache to serve
+        rarely changing GET endpoints from memory. With coalesce_requests, concurrent identical
+        GETs (same URL and Accept header) share a single in-flight request.
+
+        Failed GET requests are retried according to retry_policy (a RetryPolicy, by default
+        two retries). Each API host has a circuit breaker that opens after
+        circuit_breaker_threshold consecutive failures (0 disables it) and fails fast with
+        CircuitOpenError for circuit_breaker_reset seconds. Failed requests raise APIError.
+
+        A RateLimiter throttles every request of this account before it is sent. Pass a Metrics
+        instance to collect per endpoint request statistics.
         """
         self.email: str = email
         self.expiration: int = 0  # force credential refresh
         self.access_token: str
         self.auth_token: str
         self.head: dict = {}
-        self.refresh_token: str
+        self.refresh_token: str = ''
         self.user_id: str
-        self.vehicles: list = []
-
-        if use_china_servers:
+        self._vehicles = None
+        self._vehicles_lock = threading.Lock()
+        self.session_store = session_store
+        self.route_store = route_store
+        self.geocode_cache = geocode_cache
+        self.response_cache = ResponseCache() if response_cache is True else response_cache
+        self._inflight = _SingleFlight() if coalesce_requests else None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker_threshold = circuit_breaker_threshold
+        self.circuit_breaker_reset = circuit_breaker_reset
+        self._breakers: dict = {}
+        self._breakers_lock = threading.Lock()
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.token_refresh_skew = token_refresh_skew
+        self._auth_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_stop = threading.Event()
+        self.transport = transport or HTTPTransport(pool_connections, pool_maxsize, keep_alive)
+        self.service_token_ttl = service_token_ttl
+        self.cache_pin_services = cache_pin_services
+
+        if base_urls:
+            self.base = base_urls
+        elif use_china_servers:
             self.base = ChinaBaseURLs
         else:
             self.base = BaseURLs
@@ -76,68 +1168,279 @@ class Connection:
                 "grant_type": "password",
                 "username": email,
                 "password": password}
+        self._password_oauth = self.oauth if password else None
+        self._session_key = f"{email}@{urlsplit(self.base.IF9).netloc}"
+
+        restored = self._restore_session(device_id)
+        if not lazy:
+            if not restored:
+                self.connect()
+            self._load_vehicles()
+
+    @property
+    def vehicles(self):
+        """Vehicles associated with the account. Loaded on first access in lazy mode"""
+        if self._vehicles is None:
+            self._load_vehicles()
+        return self._vehicles
+
+    def _load_vehicles(self):
+        with self._vehicles_lock:
+            if self._vehicles is not None:
+                return
+            self.validate_token()
+            vehicles = []
+            try:
+                for vehicle in self.get_vehicles(self.head)['vehicles']:
+                    vehicles.append(Vehicle(vehicle, self))
+            except TypeError:
+                logger.error("No vehicles associated with this account")
+            self._vehicles = vehicles
+        self._save_session()
+
+    def _restore_session(self, device_id):
+        """Resume from the session store. Returns True if a session was restored"""
+        if self.session_store is None:
+            return False
+        session = self.session_store.load(self._session_key)
+        if not session or (device_id and device_id != session['device_id']):
+            return False
+        self.access_token = session['access_token']
+        self.auth_token = session['auth_token']
+        self.refresh_token = session['refresh_token']
+        self.expiration = session['expiration']
+        self.user_id = session['user_id']
+        self.device_id = session['device_id']
+        self._set_header(self.access_token)
+        if session.get('vehicles') is not None:
+            self._vehicles = [Vehicle(vehicle, self) for vehicle in session['vehicles']]
+        logger.info("[+] session restored")
+        return True
+
+    def _save_session(self):
+        if self.session_store is None or not self.expiration:
+            return
+        vehicles = self._vehicles
+        session = {
+            "access_token": self.access_token,
+            "auth_token": self.auth_token,
+            "refresh_token": self.refresh_token,
+            "expiration": self.expiration,
+            "user_id": self.user_id,
+            "device_id": self.device_id,
+            "vehicles": [dict(vehicle) for vehicle in vehicles] if vehicles is not None else None}
+        try:
+            self.session_store.save(self._session_key, session)
+        except (OSError, sqlite3.Error) as err:
+            logger.warning("Unable to save session: %s", err)
 
-        self.connect()
+    def __enter__(self):
+        return self
 
-        try:
-            for vehicle in self.get_vehicles(self.head)['vehicles']:
-                self.vehicles.append(Vehicle(vehicle, self))
-        except TypeError:
-            logger.error("No vehicles associated with this account")
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-    def validate_token(self):
-        """Is token still valid"""
+    def close(self):
+        """Stop the token refresher and close the transport"""
+        self.stop_token_refresher()
+        self.transport.close()
+
+    def _token_expiring(self):
         now = calendar.timegm(datetime.now().timetuple())
-        if now > self.expiration:
-            # Auth expired, reconnect
-            self.connect()
+        return now > self.expiration - self.token_refresh_skew
+
+    def validate_token(self):
+        """Is token still valid. Tokens are refreshed shortly before they expire"""
+        if not self._token_expiring():
+            return
+        with self._auth_lock:
+            # Another thread may have refreshed the tokens while we waited for the lock
+            if self._token_expiring():
+                self._renew_tokens()
+
+    def _renew_tokens(self):
+        """Refresh the tokens, falling back to a full login if that fails"""
+        if self.expiration and self.refresh_token:
+            try:
+                self.refresh_tokens()
+                return
+            except (KeyError, TypeError, requests.RequestException) as err:
+                logger.warning("Token refresh failed (%s), logging in again", err)
+                if self._password_oauth:
+                    self.oauth = self._password_oauth
+        # Auth expired, reconnect
+        self.connect()
+
+    def start_token_refresher(self):
+        """Keep the tokens fresh from a background thread. Useful for long running daemons"""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._refresher_stop.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="jlrpy-token-refresher", daemon=True)
+        self._refresher.start()
+
+    def stop_token_refresher(self):
+        """Stop the background token refresher"""
+        self._refresher_stop.set()
+        if self._refresher is not None and self._refresher is not threading.current_thread():
+            self._refresher.join()
+        self._refresher = None
+
+    def _refresh_loop(self):
+        while True:
+            now = calendar.timegm(datetime.now().timetuple())
+            delay = max(self.expiration - self.token_refresh_skew - now, 1)
+            if self._refresher_stop.wait(delay):
+                return
+            try:
+                self.validate_token()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Background token refresh failed")
+                if self._refresher_stop.wait(TOKEN_REFRESH_RETRY):
+                    return
+
+    def _cache_lookup(self, command, url, headers):
+        """Return (key, cached response) for cacheable GETs, (None, None) otherwise"""
+        cache = self.response_cache
+        if cache is None or not cache.ttls.get(_endpoint(command)):
+            return None, None
+        key = (f"{url}/{command}", headers.get("Accept"))
+        return key, cache.get(key)
+
+    def _cache_invalidate(self, command, url):
+        if self.response_cache is not None:
+            self.response_cache.invalidate(url, command)
+
+    def _auth_headers(self, headers):
+        """Request headers with the current token. Fills in the base headers when they
+        were copied before the first login, as in lazy mode"""
+        headers = {**self.head, **headers}
+        if headers.get('Authorization', True):
+            headers['Authorization'] = self.head['Authorization']
+        return headers
 
     def get(self, command, url, headers):
         """GET data from API"""
+        key, cached = self._cache_lookup(command, url, headers)
+        if cached is not None:
+            return cached
         self.validate_token()
-        if headers['Authorization']:
-            headers['Authorization'] = self.head['Authorization']
-        return self._request(f"{url}/{command}", headers=headers, method="GET")
+        headers = self._auth_headers(headers)
+        url = f"{url}/{command}"
+        if self._inflight is not None:
+            result = self._inflight.do((url, headers.get("Accept")),
+                                       lambda: self._request(url, headers=headers, method="GET"))
+        else:
+            result = self._request(url, headers=headers, method="GET")
+        if key is not None:
+            self.response_cache.put(key, _endpoint(command), result)
+        return result
 
     def post(self, command, url, headers, data=None):
         """POST data to API"""
         self.validate_token()
-        if headers['Authorization']:
-            headers['Authorization'] = self.head['Authorization']
-        return self._request(f"{url}/{command}", headers=headers, data=data, method="POST")
+        headers = self._auth_headers(headers)
+        result = self._request(f"{url}/{command}", headers=headers, data=data, method="POST")
+        self._cache_invalidate(command, url)
+        return result
 
     def delete(self, command, url, headers):
         """DELETE data from api"""
         self.validate_token()
-        if headers['Authorization']:
-            headers['Authorization'] = self.head['Authorization']
+        headers = self._auth_headers(headers)
         if headers["Accept"]:
             del headers["Accept"]
-        return self._request(url=f"{url}/{command}", headers=headers, method="DELETE")
+        result = self._request(url=f"{url}/{command}", headers=headers, method="DELETE")
+        self._cache_invalidate(command, url)
+        return result
 
     def connect(self):
         """Connect to JLR API"""
         logger.info("Connecting...")
-        auth = self._authenticate(data=self.oauth)
-        self._register_auth(auth)
-        self._set_header(auth['access_token'])
-        logger.info("[+] authenticated")
-        self._register_device_and_log_in()
+        with self.span("login"):
+            auth = self._authenticate(data=self.oauth)
+            self._register_auth(auth)
+            self._set_header(auth['access_token'])
+            logger.info("[+] authenticated")
+            self._register_device_and_log_in()
 
     def _register_device_and_log_in(self):
         self._register_device(self.head)
         logger.info("1/2 device id registered")
         self._login_user(self.head)
         logger.info("2/2 user logged in, user id retrieved")
+        self._save_session()
+
+    def breaker(self, url):
+        """Return the circuit breaker of the host serving url, or None if disabled"""
+        if self.circuit_breaker_threshold <= 0:
+            return None
+        host = _host(url)
+        with self._breakers_lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.circuit_breaker_threshold,
+                                                                self.circuit_breaker_reset)
+        return breaker
 
     def _request(self, url, headers=None, data=None, method="GET"):
-        ret = requests.request(method=method, url=url, headers=headers, json=data, timeout=TIMEOUT)
-        if ret.text:
+        breaker = self.breaker(url)
+        attempt = 0
+        while True:
+            # Wait for the rate limiter first, so the breaker is checked when the request is sent
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(self._rate_limit_account(), _request_class(method, url))
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(f"{method} {url} refused, circuit open for {_host(url)}", url=url)
+            start = time.monotonic()
             try:
-                return json.loads(ret.text)
-            except json.JSONDecodeError:
-                return None
-        return None
+                ret = self.transport.send(method, url, headers, data, TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                error = APIConnectionError(f"{method} {url} failed: {err}", url=url,
+                                           latency=time.monotonic() - start)
+                self._record(method, url, error.latency, None, 0, 0, error)
+            except BaseException:
+                # Any other error, e.g. a transport bug, says nothing about the host
+                if breaker is not None:
+                    breaker.release()
+                raise
+            else:
+                latency = time.monotonic() - start
+                error = None
+                if ret.status_code >= 400:
+                    error = APIStatusError(f"{method} {url} returned {ret.status_code}: {ret.text[:200]}",
+                                           status_code=ret.status_code, url=url, latency=latency, response=ret)
+                self._record(method, url, latency, ret.status_code, ret.bytes_sent, ret.bytes_received, error)
+                if error is None:
+                    if breaker is not None:
+                        breaker.record_success()
+                    return _parse_body(ret.text)
+            if breaker is not None:
+                if _is_host_failure(error):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if not self.retry_policy.should_retry(method, error, attempt):
+                raise error
+            delay = self.retry_policy.delay(attempt, error)
+            logger.debug("%s, retrying in %.2fs", error, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _rate_limit_account(self):
+        """Rate limiter account of the connection: the email, else the user id once logged in, else the
+        device id, so connections created from refresh tokens without an email never share a bucket"""
+        return self.email or getattr(self, 'user_id', None) or self.device_id
+
+    def _record(self, method, url, latency, status_code, bytes_sent, bytes_received, error):
+        if self.metrics is not None:
+            self.metrics.record_request(method, url, latency, status_code, bytes_sent, bytes_received, error)
+
+    def span(self, phase, **attributes):
+        """Context manager timing a client phase in the connection metrics, if enabled"""
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.span(phase, **attributes)
 
     def _register_auth(self, auth):
         self.access_token = auth['access_token']
@@ -194,11 +1497,12 @@ class Connection:
             "grant_type": "refresh_token",
             "refresh_token": self.refresh_token}
 
-        auth = self._authenticate(self.oauth)
-        self._register_auth(auth)
-        self._set_header(auth['access_token'])
-        logger.info("[+] Tokens refreshed")
-        self._register_device_and_log_in()
+        with self.span("token_refresh"):
+            auth = self._authenticate(self.oauth)
+            self._register_auth(auth)
+            self._set_header(auth['access_token'])
+            logger.info("[+] Tokens refreshed")
+            self._register_device_and_log_in()
 
     def get_vehicles(self, headers):
         """Get vehicles for user"""
@@ -210,7 +1514,7 @@ class Connection:
         headers = self.head.copy()
         headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.User-v3+json"
         headers["Content-Type"] = "application/json"
-        return self.get("", f"{self.base.IF9}/users?loginName={self.email}", self.head)
+        return self.get("", f"{self.base.IF9}/users?loginName={self.email}", headers)
 
     def update_user_info(self, user_info_data):
         """Update user information"""
@@ -220,9 +1524,152 @@ class Connection:
 
     def reverse_geocode(self, lat, lon):
         """Get geocode information"""
+        if self.geocode_cache is not None:
+            cached = self.geocode_cache.get(lat, lon)
+            if cached is not None:
+                return cached
         headers = self.head.copy()
         headers["Accept"] = "application/json"
-        return self.get("en", f"{self.base.IF9}/geocode/reverse/{lat}/{lon}", headers)
+        result = self.get("en", f"{self.base.IF9}/geocode/reverse/{lat}/{lon}", headers)
+        if self.geocode_cache is not None:
+            self.geocode_cache.put(lat, lon, result)
+        return result
+
+
+def _parse_timestamp(value):
+    """Parse an API timestamp such as 2020-05-18T10:30:03+0000. Returns None if not parseable"""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S.%f%z"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def _route(vin, trip_id, waypoints):
+    """Return the route of a trip, raising APIError for an empty one since it may only be a bad response"""
+    if not waypoints:
+        raise APIError(f"No route waypoints returned for trip {trip_id} of {vin}")
+    return {"tripId": trip_id, "waypoints": waypoints}
+
+
+def _next_trip_page(trips, count, seen):
+    """Return the unseen trips of a page newest first and the cursor of the next page, or None"""
+    trips = sorted(trips, key=lambda trip: trip.get("tripDetails", {}).get("startTime") or "", reverse=True)
+    new = [trip for trip in trips if trip.get("id") not in seen]
+    oldest = _parse_timestamp(new[-1].get("tripDetails", {}).get("startTime")) if new else None
+    if len(trips) < count or oldest is None:
+        return new, None
+    # Trips starting in the same second as the oldest one may continue on the next page
+    return new, ((oldest + timedelta(seconds=1)).isoformat(), {trip.get("id") for trip in trips})
+
+
+def _iter_pages(fetch, cursor):
+    """Yield the items of successive pages, fetching the next page in the background
+
+    fetch(cursor) returns the items of a page and the cursor of the next page, or None after the last page.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(fetch, cursor)
+        while future is not None:
+            items, cursor = future.result()
+            future = executor.submit(fetch, cursor) if cursor is not None else None
+            yield from items
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def _aiter_pages(fetch, cursor):
+    """Asyncio version of _iter_pages for coroutine fetch functions"""
+    task = asyncio.ensure_future(fetch(cursor))
+    try:
+        while task is not None:
+            items, cursor = await task
+            task = asyncio.ensure_future(fetch(cursor)) if cursor is not None else None
+            for item in items:
+                yield item
+    finally:
+        if task is not None:
+            task.cancel()
+
+
+class VehicleStatus:
+    """Indexed vehicle status.
+
+    Built once from a get_status() response. Core and EV status values are looked up by key,
+    the vehicle alerts and the last updated time (timezone aware datetime) are kept as attributes.
+    """
+
+    __slots__ = ('_values', 'alerts', 'last_updated')
+
+    def __init__(self, status):
+        vehicle_status = status.get('vehicleStatus') or {}
+        values = {}
+        for section in ('coreStatus', 'evStatus'):
+            for entry in vehicle_status.get(section) or ():
+                values[sys.intern(entry['key'])] = entry['value']
+        self._values = values
+        self.alerts = status.get('vehicleAlerts') or []
+        self.last_updated = _parse_timestamp(status.get('lastUpdatedTime'))
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"<VehicleStatus {len(self._values)} keys, last updated {self.last_updated}>"
+
+    def get(self, key, default=None):
+        """Get the raw value of key"""
+        return self._values.get(key, default)
+
+    def age(self):
+        """Seconds since the vehicle last reported its status, or None if unknown"""
+        if self.last_updated is None:
+            return None
+        return (datetime.now(self.last_updated.tzinfo) - self.last_updated).total_seconds()
+
+    def is_stale(self, max_age):
+        """Whether the status is older than max_age seconds or of unknown age"""
+        age = self.age()
+        return age is None or age > max_age
+
+    def keys(self):
+        """Status keys"""
+        return self._values.keys()
+
+    def items(self):
+        """Status key/value pairs"""
+        return self._values.items()
+
+    def get_int(self, key, default=None):
+        """Get the value of key as an int, or default if missing or not numeric"""
+        try:
+            return int(float(self._values[key]))
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=None):
+        """Get the value of key as a float, or default if missing or not numeric"""
+        try:
+            return float(self._values[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+
+# Service tokens of the running CommandPipeline, by (vin, service, pin). Only visible to its steps
+_pipeline_tokens = contextvars.ContextVar("jlrpy_pipeline_tokens", default=None)
 
 
 class Vehicle(dict):
@@ -237,6 +1684,8 @@ class Vehicle(dict):
         super().__init__(data)
         self.connection = connection
         self.vin = data['vin']
+        self._service_tokens: dict = {}
+        self._service_tokens_lock = threading.Lock()
 
     def get_contact_info(self, mcc):
         """ Get contact info for the specified mobile country code"""
@@ -249,20 +1698,39 @@ class Vehicle(dict):
         headers["Accept"] = "application/vnd.ngtp.org.VehicleAttributes-v8+json"
         return self.get('attributes', headers)
 
-    def get_status(self, key=None):
-        """Get vehicle status"""
+    def get_status(self, key=None, structured=False):
+        """Get vehicle status
+
+        Returns the value of key if specified, a VehicleStatus if structured is set
+        and the raw response otherwise.
+        """
         headers = self.connection.head.copy()
         headers["Accept"] = "application/vnd.ngtp.org.if9.healthstatus-v4+json"
         result = self.get('status?includeInactive=true', headers)
 
         if key:
-            core_status = result['vehicleStatus']['coreStatus']
-            ev_status = result['vehicleStatus']['evStatus']
-            core_status = core_status + ev_status
-            return {d['key']: d['value'] for d in core_status}[key]
+            return VehicleStatus(result)[key]
+        if structured:
+            return VehicleStatus(result)
 
         return result
 
+    def refresh_status(self, max_age=STATUS_MAX_AGE, timeout=SERVICE_TIMEOUT):
+        """Get the vehicle status as a VehicleStatus no older than max_age seconds
+
+        The current status is read first. Only if it is stale is the vehicle woken with a
+        health status request; once that service has finished, or after timeout seconds, the
+        status is read again.
+        """
+        status = self.get_status(structured=True)
+        if not status.is_stale(max_age):
+            return status
+        try:
+            self.wait_for_service(self.get_health_status(), timeout)
+        except ServiceTimeoutError as err:
+            logger.warning("Health status update of %s did not finish: %s", self.vin, err)
+        return self.get_status(structured=True)
+
     def get_health_status(self):
         """Get vehicle health status"""
         headers = self.connection.head.copy()
@@ -344,9 +1812,75 @@ class Vehicle(dict):
         headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.GuardianSystemSettings-v1+json"
         return self.get('gm/settings/system', headers)
 
-    def get_trip(self, trip_id, section=1):
+    def get_trip(self, trip_id, section=1, page_size=ROUTE_PAGE_SIZE):
         """Get info on a specific trip"""
-        return self.get(f"trips/{trip_id}/route?pageSize=1000&page={section}", self.connection.head)
+        return self.get(f"trips/{trip_id}/route?pageSize={page_size}&page={section}", self.connection.head)
+
+    _pages = staticmethod(_iter_pages)
+
+    def iter_trips(self, start=None, stop=None, page_size=TRIP_PAGE_SIZE):
+        """Iterate over all trips between start and stop, newest first. Start/Stop strings in ISO 8601 format.
+
+        Trips are requested page_size at a time, walking back from stop. The next page is fetched
+        in the background while the current one is consumed.
+        """
+        return self._pages(lambda cursor: self._trip_page(start, page_size, cursor), (stop, ()))
+
+    def _trip_page(self, start, count, cursor):
+        stop, seen = cursor
+        return _next_trip_page(self.get_trips(count, start, stop).get("trips") or [], count, seen)
+
+    def iter_route_points(self, trip_id, page_size=ROUTE_PAGE_SIZE):
+        """Iterate over the waypoints of a trip route, fetching the next page in the background"""
+        return self._pages(lambda page: self._route_page(trip_id, page_size, page), 1)
+
+    def _route_page(self, trip_id, page_size, page):
+        waypoints = (self.get_trip(trip_id, page, page_size) or {}).get("waypoints") or []
+        return waypoints, page + 1 if len(waypoints) >= page_size else None
+
+    def get_route(self, trip_id):
+        """Get the complete route of a finished trip, from the connection route_store if cached
+
+        Raises APIError if the API returns no waypoints, so an empty response is never stored.
+        """
+        store = self.connection.route_store
+        route = store.get(self.vin, trip_id) if store is not None else None
+        if route is None:
+            waypoints, page = [], 1
+            while page is not None:
+                items, page = self._route_page(trip_id, ROUTE_PAGE_SIZE, page)
+                waypoints.extend(items)
+            route = _route(self.vin, trip_id, waypoints)
+            if store is not None:
+                store.put(self.vin, trip_id, route)
+        return route
+
+    def _missing_routes(self, trip_ids):
+        store = self.connection.route_store
+        if store is None:
+            raise ValueError("download_routes requires a Connection route_store")
+        cached = store.cached(self.vin, trip_ids)
+        return list({str(trip_id): trip_id for trip_id in trip_ids if str(trip_id) not in cached}.values())
+
+    def download_routes(self, trip_ids, max_workers=ROUTE_WORKERS):
+        """Download the routes of finished trips into the connection route_store
+
+        Routes already stored are skipped and up to max_workers routes are fetched concurrently.
+        Returns the errors of failed downloads by trip id.
+        """
+        missing = self._missing_routes(trip_ids)
+        errors = {}
+        if not missing:
+            return errors
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+            futures = {executor.submit(self.get_route, trip_id): trip_id for trip_id in missing}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.warning("Unable to download route of trip %s: %s", futures[future], err)
+                    errors[futures[future]] = err
+        return errors
 
     def get_position(self):
         """Get current vehicle position"""
@@ -358,6 +1892,19 @@ class Vehicle(dict):
         headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v4+json"
         return self.get(f"services/{service_id}", headers)
 
+    def wait_for_service(self, service, timeout=SERVICE_TIMEOUT, min_interval=SERVICE_POLL_MIN,
+                         max_interval=SERVICE_POLL_MAX):
+        """Wait for a service to finish and return its final status
+
+        service is a service id or the service record returned by a command. Polls with the
+        backoff of wait_for_services and raises ServiceTimeoutError if the service is still
+        running after timeout seconds.
+        """
+        result = next(wait_for_services([(self, service)], timeout, min_interval, max_interval, max_workers=1))
+        if result.error is not None:
+            raise result.error
+        return result.status
+
     def get_services(self):
         """Get active services"""
         headers = self.connection.head.copy()
@@ -413,9 +1960,18 @@ class Vehicle(dict):
 
     def remote_engine_start(self, pin, target_value):
         """Start Remote Engine preconditioning"""
+        return self._remote_engine_start_pipeline(pin, target_value).run()["engine_on"]
+
+    def _remote_engine_start_pipeline(self, pin, target_value):
+        """PROV and REON are authenticated concurrently, then provisioning, target value and engine on"""
+        return (self.pipeline(pin)
+                .add("provisioning", self.enable_provisioning_mode, pin, services=("PROV",))
+                .add("target_value", self._post_rcc_target_value, target_value, after=("provisioning",))
+                .add("engine_on", self._engine_on, pin, after=("target_value",), services=("REON",)))
+
+    def _engine_on(self, pin):
         headers = self.connection.head.copy()
         headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json"
-        self.set_rcc_target_value(pin, target_value)
         reon_data = self.authenticate_reon(pin)
 
         return self.post("engineOn", headers, reon_data)
@@ -430,8 +1986,11 @@ class Vehicle(dict):
 
     def set_rcc_target_value(self, pin, target_value):
         """Set Remote Climate Target Value (value between 31-57, 31 is LO 57 is HOT)"""
-        headers = self.connection.head.copy()
         self.enable_provisioning_mode(pin)
+        self._post_rcc_target_value(target_value)
+
+    def _post_rcc_target_value(self, target_value):
+        headers = self.connection.head.copy()
         service_parameters = {
             "key": "ClimateControlRccTargetTemp",
             "value": str(target_value),
@@ -464,6 +2023,30 @@ class Vehicle(dict):
         service_parameters = [{"key": "PRIORITY_SETTING", "value": priority}]
         return self._preconditioning_control(service_parameters)
 
+    def climate_start(self, target_temp, priority=None):
+        """Start climate preconditioning, setting the climate priority first if given"""
+        return self._climate_start_pipeline(target_temp, priority).run()["preconditioning"]
+
+    def _climate_start_pipeline(self, target_temp, priority):
+        pipeline = self.pipeline()
+        if priority is not None:
+            pipeline.add("priority", self.climate_prioritize, priority, services=("ECC",))
+        return pipeline.add("preconditioning", self.preconditioning_start, target_temp,
+                            after=("priority",) if priority is not None else (), services=("ECC",))
+
+    def lock_and_check(self, pin, timeout=SERVICE_TIMEOUT):
+        """Lock the vehicle, wait for the lock service to finish and read the resulting status
+
+        Returns a dict with the lock service record, its final status and the VehicleStatus.
+        """
+        return self._lock_and_check_pipeline(pin, timeout).run()
+
+    def _lock_and_check_pipeline(self, pin, timeout):
+        return (self.pipeline(pin)
+                .add("lock", self.lock, pin, services=("RDL",))
+                .add("service", self.wait_for_service, CommandPipeline.result("lock"), timeout)
+                .add("status", self.get_status, after=("service",), structured=True))
+
     def _preconditioning_control(self, service_parameters):
         """Control the climate preconditioning"""
         headers = self.connection.head.copy()
@@ -504,21 +2087,13 @@ class Vehicle(dict):
 
     def add_departure_timer(self, index, year, month, day, hour, minute):
         """Add a single departure timer with the specified index"""
-        departure_timer_setting = {"timers": [
-            {"departureTime": {"hour": hour, "minute": minute},
-             "timerIndex": index, "timerTarget":
-                 {"singleDay": {"day": day, "month": month, "year": year}},
-             "timerType": {"key": "BOTHCHARGEANDPRECONDITION", "value": True}}]}
+        departure_timer_setting = {"timers": [departure_timer(index, hour, minute, year=year, month=month, day=day)]}
 
         return self._charging_profile_control("departureTimerSetting", departure_timer_setting)
 
     def add_repeated_departure_timer(self, index, schedule, hour, minute):
         """Add repeated departure timer."""
-        departure_timer_setting = {"timers": [
-            {"departureTime": {"hour": hour, "minute": minute},
-             "timerIndex": index, "timerTarget":
-                 {"repeatSchedule": schedule},
-             "timerType": {"key": "BOTHCHARGEANDPRECONDITION", "value": True}}]}
+        departure_timer_setting = {"timers": [departure_timer(index, hour, minute, schedule=schedule)]}
 
         return self._charging_profile_control("departureTimerSetting", departure_timer_setting)
 
@@ -530,26 +2105,47 @@ class Vehicle(dict):
 
     def add_charging_period(self, index, schedule, hour_from, minute_from, hour_to, minute_to):
         """Add charging period"""
-        tariff_settings = {"tariffs": [
-            {"tariffIndex": index, "tariffDefinition": {"enabled": True,
-                                                        "repeatSchedule": schedule,
-                                                        "tariffZone": [
-                                                            {"zoneName": "TARIFF_ZONE_A",
-                                                             "bandType": "PEAK",
-                                                             "endTime": {
-                                                                 "hour": hour_from,
-                                                                 "minute": minute_from}},
-                                                            {"zoneName": "TARIFF_ZONE_B",
-                                                             "bandType": "OFFPEAK",
-                                                             "endTime": {"hour": hour_to,
-                                                                         "minute": minute_to}},
-                                                            {"zoneName": "TARIFF_ZONE_C",
-                                                             "bandType": "PEAK",
-                                                             "endTime": {"hour": 0,
-                                                                         "minute": 0}}]}}]}
+        tariff_settings = {"tariffs": [charging_period(index, schedule, hour_from, minute_from, hour_to, minute_to)]}
 
         return self._charging_profile_control("tariffSettings", tariff_settings)
 
+    def update_charging_profile(self, timers=(), tariffs=(), replace_timers=False):
+        """Apply many departure timers and charging periods with as few chargeProfile requests as possible
+
+        timers and tariffs are built with departure_timer and charging_period. Timers are
+        compared with get_departure_timers() and only new or changed ones are sent; with
+        replace_timers, timers not in timers are deleted. The API has no tariff getter, so
+        tariffs are always sent. Timers and tariffs go out in one request, or one request each
+        if the API rejects the combination. Returns the service records of the requests sent.
+        """
+        current = self.get_departure_timers() if timers or replace_timers else None
+        settings = _charging_profile_settings(current, timers, tariffs, replace_timers)
+        return self._charging_profile_update(settings) if settings else []
+
+    def set_departure_timers(self, timers, replace=False):
+        """Set many departure timers in one request, see update_charging_profile"""
+        return self.update_charging_profile(timers=timers, replace_timers=replace)
+
+    def set_charging_periods(self, tariffs):
+        """Set many charging periods in one request, see update_charging_profile"""
+        return self.update_charging_profile(tariffs=tariffs)
+
+    def _charging_profile_update(self, settings):
+        """Send several chargeProfile settings in one request, or one request each if that is rejected"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v5+json"
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.PhevService-v1+json; charset=utf-8"
+
+        cp_data = self.authenticate_cp()
+        cp_data.update(settings)
+        try:
+            return [self.post("chargeProfile", headers, cp_data)]
+        except APIStatusError as err:
+            if len(settings) < 2 or err.status_code not in CHARGE_PROFILE_REJECTED_STATUSES:
+                raise
+            logger.info("Combined chargeProfile request rejected (%s), sending settings separately", err.status_code)
+        return [self._charging_profile_control(key, value) for key, value in settings.items()]
+
     def _charging_profile_control(self, service_parameter_key, service_parameters):
         """Charging profile API"""
         headers = self.connection.head.copy()
@@ -701,13 +2297,104 @@ class Vehicle(dict):
 
     def _authenticate_service(self, pin, service_name):
         """Authenticate to specified service with the provided PIN"""
+        cached = self._cached_service_token(pin, service_name)
+        if cached is not None:
+            return cached
+
         data = {
             "serviceName": service_name,
             "pin": str(pin)
         }
         headers = self.connection.head.copy()
         headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.AuthenticateRequest-v2+json; charset=utf-8"
-        return self.post(f"users/{self.connection.user_id}/authenticate", headers, data)
+        with self.connection.span("service_auth", service=service_name):
+            token = self.post(f"users/{self.connection.user_id}/authenticate", headers, data)
+        self._cache_service_token(pin, service_name, token)
+        return token
+
+    def pipeline(self, pin=None, max_workers=PIPELINE_WORKERS):
+        """Return an empty CommandPipeline for this vehicle. pin is used for PIN protected services"""
+        return CommandPipeline(self, pin, max_workers)
+
+    def _service_pin(self, service_name, pin):
+        if service_name in EMPTY_PIN_SERVICES:
+            return ""
+        if service_name in VIN_PIN_SERVICES:
+            return self.vin[-4:]
+        return pin
+
+    def _share_pipeline_token(self, service_name, pin, token):
+        tokens = _pipeline_tokens.get()
+        if tokens is not None and isinstance(token, dict) and token.get("token"):
+            with self._service_tokens_lock:
+                tokens[(self.vin, service_name, str(pin))] = dict(token)
+        return token
+
+    def _prefetch_service_token(self, service_name, pin):
+        """Authenticate a service for a pipeline run and share the token with its steps"""
+        pin = self._service_pin(service_name, pin)
+        return self._share_pipeline_token(service_name, pin, self._authenticate_service(pin, service_name))
+
+    def _service_token_cacheable(self, service_name):
+        if self.connection.service_token_ttl <= 0:
+            return False
+        return self.connection.cache_pin_services or service_name not in PIN_PROTECTED_SERVICES
+
+    def _cached_service_token(self, pin, service_name):
+        """Return a copy of a cached, unexpired service token or None"""
+        tokens = _pipeline_tokens.get()
+        if tokens is not None:
+            with self._service_tokens_lock:
+                shared = tokens.get((self.vin, service_name, str(pin)))
+            if shared is not None:
+                return dict(shared)
+        if not self._service_token_cacheable(service_name):
+            return None
+        with self._service_tokens_lock:
+            entry = self._service_tokens.get((service_name, str(pin)))
+            if entry is None:
+                return None
+            expires_at, token = entry
+            if time.monotonic() >= expires_at:
+                del self._service_tokens[(service_name, str(pin))]
+                return None
+        logger.debug("Reusing cached %s service token", service_name)
+        return dict(token)
+
+    def _cache_service_token(self, pin, service_name, token):
+        if not isinstance(token, dict) or not token.get("token"):
+            return
+        if not self._service_token_cacheable(service_name):
+            return
+        expires_at = time.monotonic() + self.connection.service_token_ttl
+        with self._service_tokens_lock:
+            self._service_tokens[(service_name, str(pin))] = (expires_at, dict(token))
+
+    def _discard_service_token(self, token):
+        """Drop the cache entry holding token, if any"""
+        with self._service_tokens_lock:
+            for key, (_, cached) in list(self._service_tokens.items()):
+                if cached.get("token") == token:
+                    del self._service_tokens[key]
+            tokens = _pipeline_tokens.get() or {}
+            for key, shared in list(tokens.items()):
+                if shared.get("token") == token:
+                    del tokens[key]
+
+    def invalidate_service_tokens(self, service_name=None):
+        """Drop cached service tokens, for all services or only the specified one"""
+        with self._service_tokens_lock:
+            if service_name is None:
+                self._service_tokens.clear()
+            else:
+                for key in [key for key in self._service_tokens if key[0] == service_name]:
+                    del self._service_tokens[key]
+
+    def _check_service_token(self, data, error):
+        """Invalidate the service token used by a command the API rejected"""
+        if error.status_code and 400 <= error.status_code < 500 and isinstance(data, dict) and data.get("token"):
+            logger.debug("Command rejected (%s), discarding service token", error.status_code)
+            self._discard_service_token(data["token"])
 
     def get(self, command, headers):
         """Utility command to get vehicle data from API"""
@@ -715,8 +2402,1583 @@ class Vehicle(dict):
 
     def post(self, command, headers, data):
         """Utility command to post data to VHS"""
-        return self.connection.post(command, f"{self.connection.base.IF9}/vehicles/{self.vin}", headers, data)
+        try:
+            return self.connection.post(command, f"{self.connection.base.IF9}/vehicles/{self.vin}", headers, data)
+        except APIStatusError as err:
+            self._check_service_token(data, err)
+            raise
 
     def delete(self, command, headers):
         """Utility command to delete active service entry"""
         return self.connection.delete(command, f"{self.connection.base.IF9}/vehicles/{self.vin}", headers)
+
+
+def haversine(origin, destination):
+    """Return the great circle distance in metres between two (latitude, longitude) tuples"""
+    lat1, lon1 = map(math.radians, origin)
+    lat2, lon2 = map(math.radians, destination)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def _epoch(value):
+    """Return an API timestamp as seconds since the epoch, NaN if not parseable"""
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        parsed = _parse_timestamp(value)
+        return parsed.timestamp() if parsed is not None else math.nan
+
+
+def _column(values):
+    """Return values as a contiguous float64 column, a numpy array if numpy is installed"""
+    if numpy is not None:
+        if isinstance(values, array.array):
+            return numpy.frombuffer(values, dtype=float)
+        return numpy.array(values, dtype=float)
+    return values if isinstance(values, array.array) else array.array('d', values)
+
+
+Stop = namedtuple('Stop', ['first', 'last', 'duration', 'latitude', 'longitude'])
+Stop.__doc__ = """Stop detected in a RouteTrace: indices of its first and last point, seconds and mean position"""
+
+
+class RouteTrace:
+    """Trip route stored as contiguous latitude, longitude, timestamp and speed columns
+
+    Columns are float64 numpy arrays when numpy is installed (pip install jlrpy[numpy]) and
+    array.array('d') otherwise, so no per point Python objects are kept. Timestamps are
+    seconds since the epoch and speed is the speed reported by the vehicle; missing values
+    are NaN. Distances are in metres and computed speeds in metres per second.
+    """
+
+    __slots__ = ('latitude', 'longitude', 'timestamp', 'speed')
+
+    def __init__(self, latitude, longitude, timestamp, speed=None):
+        self.latitude = _column(latitude)
+        self.longitude = _column(longitude)
+        self.timestamp = _column(timestamp)
+        self.speed = _column(speed if speed is not None else [math.nan] * len(self.latitude))
+        if not len(self.latitude) == len(self.longitude) == len(self.timestamp) == len(self.speed):
+            raise ValueError("RouteTrace columns must have the same length")
+
+    @classmethod
+    def from_waypoints(cls, waypoints):
+        """Build a trace from the waypoints returned by get_trip or iter_route_points"""
+        latitude, longitude = array.array('d'), array.array('d')
+        timestamp, speed = array.array('d'), array.array('d')
+        for waypoint in waypoints:
+            position = waypoint.get("position", {})
+            latitude.append(position.get("latitude", math.nan))
+            longitude.append(position.get("longitude", math.nan))
+            speed.append(position.get("speed", math.nan))
+            timestamp.append(_epoch(waypoint.get("timestamp")))
+        return cls(latitude, longitude, timestamp, speed)
+
+    @classmethod
+    def from_route(cls, route):
+        """Build a trace from a route returned by get_route"""
+        return cls.from_waypoints(route.get("waypoints") or [])
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def _take(self, indices):
+        if numpy is not None:
+            return RouteTrace(self.latitude[indices], self.longitude[indices], self.timestamp[indices],
+                              self.speed[indices])
+        columns = (self.latitude, self.longitude, self.timestamp, self.speed)
+        return RouteTrace(*([column[i] for i in indices] for column in columns))
+
+    def distances(self):
+        """Return the haversine distance of every segment between consecutive points"""
+        if numpy is not None:
+            lat, lon = numpy.radians(self.latitude), numpy.radians(self.longitude)
+            a = (numpy.sin(numpy.diff(lat) / 2) ** 2
+                 + numpy.cos(lat[:-1]) * numpy.cos(lat[1:]) * numpy.sin(numpy.diff(lon) / 2) ** 2)
+            return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+        points = list(zip(self.latitude, self.longitude))
+        return array.array('d', (haversine(a, b) for a, b in zip(points, points[1:])))
+
+    def length(self):
+        """Return the total length of the route"""
+        return float(sum(self.distances())) if numpy is None else float(self.distances().sum())
+
+    def speeds(self):
+        """Return the average speed over every segment, NaN where no time elapsed"""
+        distances = self.distances()
+        if numpy is not None:
+            durations = numpy.diff(self.timestamp)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                return numpy.where(durations > 0, distances / durations, numpy.nan)
+        times = self.timestamp
+        return array.array('d', (distance / (t2 - t1) if t2 > t1 else math.nan
+                                 for distance, t1, t2 in zip(distances, times, times[1:])))
+
+    def stops(self, speed_threshold=1.0, min_duration=120):
+        """Return the periods of at least min_duration seconds spent below speed_threshold metres per second"""
+        speeds = self.speeds()
+        if numpy is not None:
+            edges = numpy.diff(numpy.concatenate(([0], (speeds < speed_threshold).view(numpy.int8), [0])))
+            runs = zip(numpy.flatnonzero(edges == 1).tolist(), numpy.flatnonzero(edges == -1).tolist())
+        else:
+            runs, first = [], None
+            for i, speed in enumerate(itertools.chain(speeds, [math.nan])):
+                if speed < speed_threshold:
+                    first = i if first is None else first
+                elif first is not None:
+                    runs.append((first, i))
+                    first = None
+        stops = []
+        for first, last in runs:
+            duration = self.timestamp[last] - self.timestamp[first]
+            if duration >= min_duration:
+                latitude, longitude = self.latitude[first:last + 1], self.longitude[first:last + 1]
+                stops.append(Stop(first, last, float(duration), float(sum(latitude) / len(latitude)),
+                                  float(sum(longitude) / len(longitude))))
+        return stops
+
+    def downsample(self, distance=None, interval=None):
+        """Return a trace keeping one point per distance metres travelled and/or per interval seconds
+
+        The first and last points are always kept.
+        """
+        if len(self) < 3 or (distance is None and interval is None):
+            return self._take(list(range(len(self))))
+        if numpy is not None:
+            keep = numpy.zeros(len(self), dtype=bool)
+            if distance is not None:
+                buckets = numpy.floor(numpy.concatenate(([0.0], numpy.cumsum(self.distances()))) / distance)
+                keep[1:] |= numpy.diff(buckets) != 0
+            if interval is not None:
+                keep[1:] |= numpy.diff(numpy.floor((self.timestamp - self.timestamp[0]) / interval)) != 0
+            keep[0] = keep[-1] = True
+            return self._take(numpy.flatnonzero(keep))
+        indices, travelled = [0], 0.0
+        last_distance = last_time = 0
+        for i, segment in enumerate(self.distances(), 1):
+            travelled += segment
+            if ((distance is not None and travelled // distance != last_distance)
+                    or (interval is not None
+                        and (self.timestamp[i] - self.timestamp[0]) // interval != last_time)):
+                indices.append(i)
+            if distance is not None:
+                last_distance = travelled // distance
+            if interval is not None:
+                last_time = (self.timestamp[i] - self.timestamp[0]) // interval
+        if indices[-1] != len(self) - 1:
+            indices.append(len(self) - 1)
+        return self._take(indices)
+
+
+class Geofence:
+    """Base class for named geofences
+
+    Subclasses set bounds to (min_latitude, min_longitude, max_latitude, max_longitude) and
+    implement contains for a single position and contains_many for columns of positions.
+    """
+
+    bounds = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def contains(self, latitude, longitude):
+        """Return whether the position is inside the fence"""
+        raise NotImplementedError
+
+    def contains_many(self, latitude, longitude):
+        """Return for every position in the latitude and longitude columns whether it is inside the fence"""
+        # numpy call overhead outweighs the gain for a handful of positions
+        if numpy is not None and len(latitude) >= 16:
+            return self._contains_array(numpy.asarray(latitude, dtype=float), numpy.asarray(longitude, dtype=float))
+        return [self.contains(lat, lon) for lat, lon in zip(latitude, longitude)]
+
+    def _contains_array(self, latitude, longitude):
+        return numpy.fromiter(map(self.contains, latitude, longitude), dtype=bool, count=len(latitude))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+
+class CircleFence(Geofence):
+    """Geofence of radius metres around a center position"""
+
+    def __init__(self, name, latitude, longitude, radius):
+        super().__init__(name)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        dlat = math.degrees(radius / EARTH_RADIUS)
+        dlon = min(dlat / max(math.cos(math.radians(latitude)), 1e-6), 180.0)
+        self.bounds = (latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon)
+
+    def contains(self, latitude, longitude):
+        return haversine((self.latitude, self.longitude), (latitude, longitude)) <= self.radius
+
+    def _contains_array(self, latitude, longitude):
+        lat1, lat2 = math.radians(self.latitude), numpy.radians(latitude)
+        a = (numpy.sin((lat2 - lat1) / 2) ** 2
+             + math.cos(lat1) * numpy.cos(lat2) * numpy.sin(numpy.radians(longitude - self.longitude) / 2) ** 2)
+        return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0))) <= self.radius
+
+
+class PolygonFence(Geofence):
+    """Geofence bounded by a polygon of (latitude, longitude) vertices
+
+    Edges are straight lines in latitude/longitude, which is accurate for fences up to a few
+    tens of kilometres across that do not cross the antimeridian.
+    """
+
+    def __init__(self, name, points):
+        super().__init__(name)
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        if len(self.points) < 3:
+            raise ValueError("A polygon fence needs at least three points")
+        lats, lons = zip(*self.points)
+        self.bounds = (min(lats), min(lons), max(lats), max(lons))
+
+    def _edges(self):
+        return zip(self.points, self.points[1:] + self.points[:1])
+
+    def contains(self, latitude, longitude):
+        inside = False
+        for (lat1, lon1), (lat2, lon2) in self._edges():
+            if (lat1 > latitude) != (lat2 > latitude):
+                if longitude < lon1 + (latitude - lat1) * (lon2 - lon1) / (lat2 - lat1):
+                    inside = not inside
+        return inside
+
+    def _contains_array(self, latitude, longitude):
+        inside = numpy.zeros(len(latitude), dtype=bool)
+        for (lat1, lon1), (lat2, lon2) in self._edges():
+            if lat1 == lat2:
+                continue
+            crosses = (lat1 > latitude) != (lat2 > latitude)
+            inside ^= crosses & (longitude < lon1 + (latitude - lat1) * (lon2 - lon1) / (lat2 - lat1))
+        return inside
+
+
+GeofenceEvent = namedtuple('GeofenceEvent', ['vin', 'fence', 'event', 'latitude', 'longitude'])
+GeofenceEvent.__doc__ = """Vehicle entering or leaving a geofence. event is 'enter' or 'exit'"""
+
+
+def _coordinates(position):
+    """Return (latitude, longitude) of a get_position() result or a (latitude, longitude) tuple, or None"""
+    if isinstance(position, dict):
+        position = position.get("position", position)
+        try:
+            return float(position["latitude"]), float(position["longitude"])
+        except (KeyError, TypeError, ValueError):
+            return None
+    return (float(position[0]), float(position[1])) if position is not None else None
+
+
+class GeofenceIndex:
+    """Grid spatial index over many geofences
+
+    Each fence is registered in the cell_size degree grid cells its bounds overlap, so a
+    position is only tested against the fences of its own cell.
+    """
+
+    def __init__(self, fences=(), cell_size=GEOFENCE_CELL_SIZE):
+        self.cell_size = cell_size
+        self.fences = {}
+        self._cells = {}
+        for fence in fences:
+            self.add(fence)
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def _fence_cells(self, fence):
+        min_lat, min_lon, max_lat, max_lon = fence.bounds
+        (lat1, lon1), (lat2, lon2) = self._cell(min_lat, min_lon), self._cell(max_lat, max_lon)
+        return itertools.product(range(lat1, lat2 + 1), range(lon1, lon2 + 1))
+
+    def add(self, fence):
+        """Add a fence, replacing any fence with the same name"""
+        self.remove(fence.name)
+        self.fences[fence.name] = fence
+        for cell in self._fence_cells(fence):
+            self._cells.setdefault(cell, []).append(fence)
+
+    def remove(self, name):
+        """Remove the fence with the given name if present"""
+        fence = self.fences.pop(name, None)
+        if fence is not None:
+            for cell in self._fence_cells(fence):
+                self._cells[cell].remove(fence)
+                if not self._cells[cell]:
+                    del self._cells[cell]
+
+    def classify(self, latitude, longitude):
+        """Return the names of the fences containing a position"""
+        return frozenset(fence.name for fence in self._cells.get(self._cell(latitude, longitude), ())
+                         if fence.contains(latitude, longitude))
+
+    def classify_many(self, positions):
+        """Return the names of the fences containing each position
+
+        positions maps keys such as VINs to get_position() results or (latitude, longitude)
+        tuples. Positions are grouped by grid cell and every candidate fence is tested against
+        all positions of a cell in one vectorized call. Keys without a valid position are omitted.
+        """
+        groups = {}
+        for key, position in positions.items():
+            coordinates = _coordinates(position)
+            if coordinates is not None:
+                groups.setdefault(self._cell(*coordinates), []).append((key, coordinates))
+        result = {}
+        for cell, members in groups.items():
+            keys = [key for key, _ in members]
+            names = {key: [] for key in keys}
+            fences = self._cells.get(cell)
+            if fences:
+                latitude, longitude = zip(*(coordinates for _, coordinates in members))
+                for fence in fences:
+                    for key, inside in zip(keys, fence.contains_many(latitude, longitude)):
+                        if inside:
+                            names[key].append(fence.name)
+            for key in keys:
+                result[key] = frozenset(names[key])
+        return result
+
+
+class GeofenceMonitor:
+    """Tracks which fences of a GeofenceIndex each vehicle is in and reports transitions"""
+
+    def __init__(self, index):
+        self.index = index
+        self.inside = {}
+        self._lock = threading.Lock()
+
+    def update(self, positions):
+        """Classify a batch of positions and return the GeofenceEvents since the previous update
+
+        positions maps VINs to get_position() results or (latitude, longitude) tuples, as
+        collected with Fleet.poll_position. The first position of a vehicle reports 'enter'
+        for every fence it is in.
+        """
+        classified = self.index.classify_many(positions)
+        events = []
+        with self._lock:
+            for vin, names in classified.items():
+                previous = self.inside.get(vin, frozenset())
+                latitude, longitude = _coordinates(positions[vin])
+                events.extend(GeofenceEvent(vin, name, 'exit', latitude, longitude)
+                              for name in sorted(previous - names))
+                events.extend(GeofenceEvent(vin, name, 'enter', latitude, longitude)
+                              for name in sorted(names - previous))
+                self.inside[vin] = names
+        return events
+
+
+ServiceResult = namedtuple('ServiceResult', ['vin', 'service_id', 'status', 'error', 'elapsed'])
+ServiceResult.__doc__ = """Outcome of waiting for a service. status is its last status, error the exception if any"""
+
+
+def _service_id(service):
+    """Return the id of a service given as an id or as the record returned by a command"""
+    return service.get("customerServiceId") if isinstance(service, dict) else service
+
+
+def _service_poll_delay(elapsed, min_interval, max_interval):
+    return min(max_interval, max(min_interval, elapsed * SERVICE_POLL_BACKOFF))
+
+
+def wait_for_services(services, timeout=SERVICE_TIMEOUT, min_interval=SERVICE_POLL_MIN,
+                      max_interval=SERVICE_POLL_MAX, max_workers=FLEET_WORKERS):
+    """Wait for many vehicle services on one polling loop, yielding a ServiceResult as each one finishes
+
+    services is an iterable of (vehicle, service) pairs where service is a service id or the
+    service record returned by a command. Services are polled min_interval seconds after the
+    wait starts and then less often as the wait gets older, up to every max_interval seconds.
+    Status requests due at the same time are sent concurrently on up to max_workers threads.
+    A service stops being polled once its status is in SERVICE_TERMINAL_STATES; one still
+    running after timeout seconds is reported with a ServiceTimeoutError.
+    """
+    start = time.monotonic()
+    order = itertools.count()
+    pending = []
+    for vehicle, service in services:
+        status = service if isinstance(service, dict) else None
+        if status is not None and status.get("status") in SERVICE_TERMINAL_STATES:
+            yield ServiceResult(vehicle.vin, _service_id(service), status, None, 0.0)
+        else:
+            heapq.heappush(pending, (start + min_interval, next(order), vehicle, _service_id(service), status))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            now = time.monotonic()
+            if pending[0][0] > now:
+                time.sleep(pending[0][0] - now)
+                continue
+            due = []
+            while pending and pending[0][0] <= now:
+                due.append(heapq.heappop(pending))
+            futures = [(entry, executor.submit(entry[2].get_service_status, entry[3])) for entry in due]
+            for (_, _, vehicle, service_id, status), future in futures:
+                error = None
+                try:
+                    status = future.result()
+                except APIStatusError as err:
+                    if err.status_code is not None and err.status_code < 500:
+                        yield ServiceResult(vehicle.vin, service_id, status, err, time.monotonic() - start)
+                        continue
+                    error = err
+                except requests.RequestException as err:
+                    error = err
+                now = time.monotonic()
+                elapsed = now - start
+                if error is None and (status or {}).get("status") in SERVICE_TERMINAL_STATES:
+                    yield ServiceResult(vehicle.vin, service_id, status, None, elapsed)
+                elif elapsed >= timeout:
+                    message = f"Service {service_id} of {vehicle.vin} not finished after {elapsed:.0f}s"
+                    if error is not None:
+                        message += f", last error: {error}"
+                    yield ServiceResult(vehicle.vin, service_id, status,
+                                        ServiceTimeoutError(message, status=status), elapsed)
+                else:
+                    due_at = min(now + _service_poll_delay(elapsed, min_interval, max_interval), start + timeout)
+                    heapq.heappush(pending, (due_at, next(order), vehicle, service_id, status))
+
+
+class _StepResult:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+_Step = namedtuple('_Step', ['func', 'args', 'kwargs', 'after'])
+
+
+class CommandPipeline:
+    """Runs the steps of a multi-step vehicle operation as a dependency graph
+
+    Each step is a callable, typically a Vehicle method, that starts once the steps named in
+    its after argument have completed; independent steps run concurrently on up to
+    max_workers threads. Arguments created with result(name) are replaced by the result of
+    that step and imply the dependency. Service tokens listed in a step's services are
+    requested once per run, all concurrently as soon as the run starts, and shared by every
+    step; PIN protected services use pin.
+    """
+
+    def __init__(self, vehicle, pin=None, max_workers=PIPELINE_WORKERS):
+        self.vehicle = vehicle
+        self.pin = pin
+        self.max_workers = max_workers
+        self.steps = OrderedDict()
+        self.services = []
+        self.results = {}
+
+    @staticmethod
+    def result(name):
+        """Return a placeholder argument for the result of step name"""
+        return _StepResult(name)
+
+    def add(self, name, func, *args, after=(), services=(), **kwargs):
+        """Add a step and return the pipeline"""
+        if name in self.steps:
+            raise ValueError(f"Duplicate pipeline step {name}")
+        refs = [arg.name for arg in itertools.chain(args, kwargs.values()) if isinstance(arg, _StepResult)]
+        for service in services:
+            if service not in self.services:
+                self.services.append(service)
+        after = tuple(after) + tuple(refs) + tuple(f"authenticate:{service}" for service in services)
+        self.steps[name] = _Step(func, args, kwargs, after)
+        return self
+
+    def _graph(self):
+        graph = OrderedDict((f"authenticate:{service}",
+                             _Step(self.vehicle._prefetch_service_token, (service, self.pin), {}, ()))
+                            for service in self.services)
+        graph.update(self.steps)
+        done = set()
+        pending = dict(graph)
+        while pending:
+            ready = [name for name, step in pending.items() if all(dep in done for dep in step.after)]
+            if not ready:
+                raise ValueError(f"Pipeline steps {', '.join(pending)} have unknown or circular dependencies")
+            for name in ready:
+                done.add(name)
+                del pending[name]
+        return graph
+
+    @staticmethod
+    def _arguments(step, results):
+        args = [results[arg.name] if isinstance(arg, _StepResult) else arg for arg in step.args]
+        kwargs = {key: results[value.name] if isinstance(value, _StepResult) else value
+                  for key, value in step.kwargs.items()}
+        return args, kwargs
+
+    def _finish(self, results, errors):
+        self.results = {name: results[name] for name in self.steps if name in results}
+        failed = next((name for name in self.steps if name in errors), None)
+        if failed is not None:
+            raise errors[failed]
+        return self.results
+
+    def run(self):
+        """Run all steps and return their results by step name
+
+        Steps depending on a failed step are skipped. Once all other steps have finished the
+        exception of the first failed step is raised; results of the steps that succeeded
+        remain available in results.
+        """
+        graph = self._graph()
+        results, errors = {}, {}
+        # Each step runs in a copy of a context holding this run's service tokens
+        context = contextvars.copy_context()
+        context.run(_pipeline_tokens.set, {})
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while graph or running:
+                scheduled = True
+                while scheduled:
+                    scheduled = False
+                    for name, step in list(graph.items()):
+                        failed = next((dep for dep in step.after if dep in errors), None)
+                        if failed is None and not all(dep in results for dep in step.after):
+                            continue
+                        del graph[name]
+                        scheduled = True
+                        if failed is not None:
+                            errors[name] = errors[failed]
+                        else:
+                            args, kwargs = self._arguments(step, results)
+                            running[executor.submit(context.copy().run, step.func, *args, **kwargs)] = name
+                if not running:
+                    break
+                done, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as err:  # pylint: disable=broad-except
+                        errors[name] = err
+        return self._finish(results, errors)
+
+
+class AsyncCommandPipeline(CommandPipeline):
+    """CommandPipeline for AsyncVehicle. Steps are coroutine functions and run() is a coroutine"""
+
+    async def run(self):
+        graph = self._graph()
+        results, errors = {}, {}
+
+        async def run_step(name, step):
+            for dep in step.after:
+                await tasks[dep]
+            args, kwargs = self._arguments(step, results)
+            results[name] = await step.func(*args, **kwargs)
+
+        # The step tasks inherit a context holding this run's service tokens
+        reset = _pipeline_tokens.set({})
+        try:
+            tasks = {name: asyncio.ensure_future(run_step(name, step)) for name, step in graph.items()}
+        finally:
+            _pipeline_tokens.reset(reset)
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for name, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, BaseException):
+                errors[name] = outcome
+        return self._finish(results, errors)
+
+
+def departure_timer(index, hour, minute, year=None, month=None, day=None, schedule=None):
+    """Return a departure timer for Vehicle.update_charging_profile
+
+    The timer fires once on year/month/day if given, else on the repeat schedule, a dict of
+    weekday names to booleans such as {"monday": True, ...}.
+    """
+    if year is not None:
+        target = {"singleDay": {"day": day, "month": month, "year": year}}
+    else:
+        target = {"repeatSchedule": schedule}
+    return {"departureTime": {"hour": hour, "minute": minute},
+            "timerIndex": index, "timerTarget": target,
+            "timerType": {"key": "BOTHCHARGEANDPRECONDITION", "value": True}}
+
+
+def charging_period(index, schedule, hour_from, minute_from, hour_to, minute_to):
+    """Return an off-peak charging period (tariff) for Vehicle.update_charging_profile"""
+    return {"tariffIndex": index, "tariffDefinition": {"enabled": True,
+                                                       "repeatSchedule": schedule,
+                                                       "tariffZone": [
+                                                           {"zoneName": "TARIFF_ZONE_A",
+                                                            "bandType": "PEAK",
+                                                            "endTime": {"hour": hour_from,
+                                                                        "minute": minute_from}},
+                                                           {"zoneName": "TARIFF_ZONE_B",
+                                                            "bandType": "OFFPEAK",
+                                                            "endTime": {"hour": hour_to,
+                                                                        "minute": minute_to}},
+                                                           {"zoneName": "TARIFF_ZONE_C",
+                                                            "bandType": "PEAK",
+                                                            "endTime": {"hour": 0,
+                                                                        "minute": 0}}]}}
+
+
+def _departure_timer_changes(current, timers, replace):
+    """Return the timer entries turning the get_departure_timers() response current into timers"""
+    existing = {timer.get("timerIndex"): timer
+                for timer in ((current or {}).get("departureTimerSetting") or {}).get("timers") or []}
+    wanted = {timer["timerIndex"]: timer for timer in timers}
+    changes = [timer for index, timer in wanted.items()
+               if {key: existing.get(index, {}).get(key) for key in timer} != timer]
+    if replace:
+        changes.extend({"timerIndex": index} for index in existing if index not in wanted)
+    return changes
+
+
+def _charging_profile_settings(current, timers, tariffs, replace_timers):
+    """Return the chargeProfile settings applying timers and tariffs, keyed by cp_data key"""
+    settings = {}
+    changes = _departure_timer_changes(current, timers, replace_timers)
+    if changes:
+        settings["departureTimerSetting"] = {"timers": changes}
+    tariffs = list({tariff["tariffIndex"]: tariff for tariff in tariffs}.values())
+    if tariffs:
+        settings["tariffSettings"] = {"tariffs": tariffs}
+    return settings
+
+
+FleetResult = namedtuple('FleetResult', ['vin', 'method', 'result', 'error', 'elapsed'])
+FleetResult.__doc__ = """Outcome of one vehicle call in a fleet poll. error is the exception raised, if any"""
+
+
+class Fleet:
+    """Vehicles across one or more connections, polled concurrently on a bounded thread pool
+
+    Results are yielded as they complete and a failing vehicle does not abort the batch,
+    so a sweep takes roughly as long as its slowest calls rather than the sum of all of them.
+    """
+
+    def __init__(self, connections, max_workers=FLEET_WORKERS):
+        self.connections = list(connections)
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_credentials(cls, credentials, max_workers=FLEET_WORKERS, **kwargs):
+        """Log in to every (email, password) pair concurrently. Accounts that fail to log in are skipped
+
+        Extra keyword arguments are passed on to Connection.
+        """
+        kwargs.setdefault('pool_maxsize', max_workers)
+
+        def login(credential):
+            try:
+                return Connection(*credential, **kwargs)
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error("Login failed for %s: %s", credential[0], err)
+                return None
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            connections = [c for c in pool.map(login, credentials) if c is not None]
+        return cls(connections, max_workers)
+
+    @property
+    def vehicles(self):
+        """All vehicles of all connections"""
+        return [vehicle for connection in self.connections for vehicle in connection.vehicles]
+
+    def close(self):
+        """Close all connections"""
+        for connection in self.connections:
+            connection.close()
+
+    @staticmethod
+    def _call(vehicle, method, args, kwargs):
+        start = time.monotonic()
+        try:
+            result = getattr(vehicle, method)(*args, **kwargs)
+            return FleetResult(vehicle.vin, method, result, None, time.monotonic() - start)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.debug("%s failed for %s: %s", method, vehicle.vin, err)
+            return FleetResult(vehicle.vin, method, None, err, time.monotonic() - start)
+
+    def poll(self, method, *args, vehicles=None, **kwargs):
+        """Call a Vehicle method on every vehicle and yield a FleetResult for each as it completes"""
+        if vehicles is None:
+            vehicles = self.vehicles
+        pool = ThreadPoolExecutor(self.max_workers)
+        futures = [pool.submit(self._call, vehicle, method, args, kwargs) for vehicle in vehicles]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def poll_status(self, structured=True, vehicles=None):
+        """Yield the status of every vehicle, as VehicleStatus unless structured is False"""
+        return self.poll('get_status', structured=structured, vehicles=vehicles)
+
+    def poll_position(self, vehicles=None):
+        """Yield the position of every vehicle"""
+        return self.poll('get_position', vehicles=vehicles)
+
+    def poll_health_status(self, vehicles=None):
+        """Request a health status update from every vehicle"""
+        return self.poll('get_health_status', vehicles=vehicles)
+
+
+StatusChange = namedtuple('StatusChange', ['vin', 'key', 'old', 'new', 'last_updated'])
+StatusChange.__doc__ = """Change of one status key. old is None for new keys, new is None for removed keys"""
+
+
+class StatusWatcher:
+    """Keeps the last status of every vehicle and reports only the keys that changed
+
+    Vehicle alerts are tracked as alert:<key> keys holding whether the alert is active. With
+    keys set only those keys are tracked. Callbacks registered with subscribe are called as
+    callback(change) for every change of the keys they subscribed to.
+    """
+
+    def __init__(self, keys=None):
+        self.keys = frozenset(keys) if keys is not None else None
+        self._snapshots = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, keys=None):
+        """Call callback(change) for changes of keys, or of every key if None. Returns callback"""
+        with self._lock:
+            self._subscribers.append((callback, frozenset(keys) if keys is not None else None))
+        return callback
+
+    def unsubscribe(self, callback):
+        """Stop calling callback"""
+        with self._lock:
+            self._subscribers = [entry for entry in self._subscribers if entry[0] is not callback]
+
+    def _values(self, status):
+        if not isinstance(status, VehicleStatus):
+            status = VehicleStatus(status)
+        values = dict(status.items())
+        for alert in status.alerts:
+            values[f"alert:{alert.get('key')}"] = alert.get('active')
+        if self.keys is not None:
+            values = {key: value for key, value in values.items() if key in self.keys}
+        return values, status.last_updated
+
+    def update(self, vin, status):
+        """Record the latest status of a vehicle and return the StatusChanges since the previous one
+
+        status is a get_status() response or a VehicleStatus. The first status of a vehicle is
+        the baseline and reports no changes.
+        """
+        values, last_updated = self._values(status)
+        with self._lock:
+            previous = self._snapshots.get(vin)
+            self._snapshots[vin] = values
+            subscribers = list(self._subscribers)
+        if previous is None:
+            return []
+        changes = [StatusChange(vin, key, previous.get(key), value, last_updated)
+                   for key, value in values.items() if key not in previous or previous[key] != value]
+        changes.extend(StatusChange(vin, key, value, None, last_updated)
+                       for key, value in previous.items() if key not in values)
+        for change in changes:
+            for callback, keys in subscribers:
+                if keys is None or change.key in keys:
+                    try:
+                        callback(change)
+                    except Exception:  # pylint: disable=broad-except
+                        logger.exception("Status change callback failed")
+        return changes
+
+    def observe(self, vehicle, status):
+        """Scheduler.add_status_job callback feeding the watcher"""
+        self.update(vehicle.vin, status)
+
+    def forget(self, vin=None):
+        """Drop the snapshot of a vehicle, or of all vehicles"""
+        with self._lock:
+            if vin is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(vin, None)
+
+    def watch(self, fleet, interval=60):
+        """Poll the status of every vehicle of a Fleet every interval seconds and yield the StatusChanges"""
+        while True:
+            start = time.monotonic()
+            for result in fleet.poll_status():
+                if result.error is None:
+                    yield from self.update(result.vin, result.result)
+            time.sleep(max(interval - (time.monotonic() - start), 0))
+
+
+def status_poll_interval(status, active_interval=60, idle_interval=1800):
+    """Poll interval for a VehicleStatus: short while the vehicle is charging, long while parked"""
+    if status is not None and status.get('EV_CHARGING_STATUS') == 'CHARGING':
+        return active_interval
+    return idle_interval
+
+
+class ScheduledJob:
+    """Periodic job registered with a Scheduler"""
+
+    def __init__(self, func, interval, args, kwargs, jitter, name):
+        self.func = func
+        self.interval = interval
+        self.args = args
+        self.kwargs = kwargs
+        self.jitter = jitter
+        self.name = name or getattr(func, '__name__', 'job')
+        self.next_run = 0.0
+        self.runs = 0
+        self.cancelled = False
+
+    def __repr__(self):
+        return f"<ScheduledJob {self.name} every {self.interval}s>"
+
+
+class Scheduler:
+    """Runs periodic jobs from a single dispatcher thread on a bounded worker pool
+
+    Jobs are kept in a heap ordered by their next run time. A job is rescheduled only once its
+    run has finished, so it never runs concurrently with itself. If the job function returns a
+    number it is used as the interval until the next run, which lets jobs adapt their polling
+    rate to the vehicle state. Every interval is randomised by +/- jitter (a fraction) to avoid
+    synchronised bursts.
+    """
+
+    def __init__(self, max_workers=SCHEDULER_WORKERS, jitter=SCHEDULER_JITTER):
+        self.jitter = jitter
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="jlrpy-scheduler")
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add_job(self, func, interval, *args, jitter=None, delay=None, name=None, **kwargs):
+        """Run func(*args, **kwargs) every interval seconds
+
+        The first run happens after delay seconds, by default a random fraction of the jitter
+        window so jobs added together do not all fire at once.
+        """
+        job = ScheduledJob(func, interval, args, kwargs, self.jitter if jitter is None else jitter, name)
+        if delay is None:
+            delay = random.uniform(0, interval * job.jitter)
+        self._push(job, delay)
+        return job
+
+    def add_status_job(self, vehicle, callback, active_interval=60, idle_interval=1800, **kwargs):
+        """Poll vehicle status, call callback(vehicle, status) and adapt the interval to the status"""
+        def poll():
+            status = vehicle.get_status(structured=True)
+            callback(vehicle, status)
+            return status_poll_interval(status, active_interval, idle_interval)
+
+        return self.add_job(poll, idle_interval, name=f"status-{vehicle.vin}", **kwargs)
+
+    def cancel(self, job):
+        """Stop scheduling job. A run already in progress is completed"""
+        job.cancelled = True
+
+    def _push(self, job, delay):
+        with self._cond:
+            job.next_run = time.monotonic() + delay
+            heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+            self._cond.notify()
+
+    def _run(self, job):
+        result = None
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Scheduled job %s failed", job.name)
+        job.runs += 1
+        if job.cancelled or self._stopped:
+            return
+        interval = result if isinstance(result, (int, float)) and not isinstance(result, bool) else job.interval
+        self._push(job, interval * (1 + random.uniform(-job.jitter, job.jitter)))
+
+    def _dispatch(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                next_run, _, job = self._heap[0]
+                delay = next_run - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                if not job.cancelled:
+                    self._pool.submit(self._run, job)
+
+    def start(self):
+        """Dispatch jobs from a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch, name="jlrpy-dispatcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def run(self):
+        """Dispatch jobs from the calling thread until stop() is called"""
+        self._dispatch()
+
+    def stop(self, wait=True):
+        """Stop dispatching and shut the worker pool down"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._pool.shutdown(wait=wait)
+
+
+class AsyncConnection:
+    """Asyncio connection to the JLR Remote Car API
+
+    Mirrors Connection with coroutine methods. Requires aiohttp. Use as an async context manager
+    or await open() before use; all requests share one pooled aiohttp session.
+    """
+
+    def __init__(self,
+                 email='',
+                 password='',
+                 device_id='',
+                 refresh_token='',
+                 use_china_servers=False,
+                 base_urls=None,
+                 pool_maxsize=POOL_MAXSIZE,
+                 service_token_ttl=SERVICE_TOKEN_TTL,
+                 cache_pin_services=False,
+                 token_refresh_skew=TOKEN_REFRESH_SKEW,
+                 response_cache=None,
+                 coalesce_requests=True,
+                 retry_policy=None,
+                 circuit_breaker_threshold=CIRCUIT_BREAKER_THRESHOLD,
+                 circuit_breaker_reset=CIRCUIT_BREAKER_RESET,
+                 rate_limiter=None,
+                 metrics=None,
+                 route_store=None,
+                 geocode_cache=None):
+        """Init the connection object. No requests are made until open() is awaited.
+
+        pool_maxsize bounds the number of concurrent connections per host, so gathering
+        hundreds of requests never opens more than pool_maxsize sockets to any host.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncConnection requires aiohttp. Install it with 'pip install jlrpy[async]'")
+
+        self.email: str = email
+        self.expiration: int = 0  # force credential refresh
+        self.access_token: str
+        self.auth_token: str
+        self.head: dict = {}
+        self.refresh_token: str = ''
+        self.user_id: str
+        self.vehicles: list = []
+        self.route_store = route_store
+        self.geocode_cache = geocode_cache
+        self.response_cache = ResponseCache() if response_cache is True else response_cache
+        self._inflight = _AsyncSingleFlight() if coalesce_requests else None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker_threshold = circuit_breaker_threshold
+        self.circuit_breaker_reset = circuit_breaker_reset
+        self._breakers: dict = {}
+        self._breakers_lock = threading.Lock()
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.token_refresh_skew = token_refresh_skew
+        self._auth_lock = None
+        self.pool_maxsize = pool_maxsize
+        self.service_token_ttl = service_token_ttl
+        self.cache_pin_services = cache_pin_services
+        self._session = None
+
+        if base_urls:
+            self.base = base_urls
+        elif use_china_servers:
+            self.base = ChinaBaseURLs
+        else:
+            self.base = BaseURLs
+
+        if device_id:
+            self.device_id = device_id
+        else:
+            self.device_id = str(uuid.uuid4())
+
+        if refresh_token:
+            self.oauth = {
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token}
+        else:
+            self.oauth = {
+                "grant_type": "password",
+                "username": email,
+                "password": password}
+        self._password_oauth = self.oauth if password else None
+
+    _register_auth = Connection._register_auth
+    _set_header = Connection._set_header
+    _token_expiring = Connection._token_expiring
+    _cache_lookup = Connection._cache_lookup
+    _cache_invalidate = Connection._cache_invalidate
+    _auth_headers = Connection._auth_headers
+    breaker = Connection.breaker
+    span = Connection.span
+    _record = Connection._record
+    _rate_limit_account = Connection._rate_limit_account
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """Authenticate and load the vehicles associated with the account"""
+        await self.connect()
+
+        try:
+            for vehicle in (await self.get_vehicles(self.head))['vehicles']:
+                self.vehicles.append(AsyncVehicle(vehicle, self))
+        except TypeError:
+            logger.error("No vehicles associated with this account")
+
+    async def close(self):
+        """Close the pooled HTTP session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def validate_token(self):
+        """Is token still valid. Tokens are refreshed shortly before they expire"""
+        if not self._token_expiring():
+            return
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            # Another task may have refreshed the tokens while we waited for the lock
+            if self._token_expiring():
+                await self._renew_tokens()
+
+    async def _renew_tokens(self):
+        """Refresh the tokens, falling back to a full login if that fails"""
+        if self.expiration and self.refresh_token:
+            try:
+                await self.refresh_tokens()
+                return
+            except (KeyError, TypeError, APIError) as err:
+                logger.warning("Token refresh failed (%s), logging in again", err)
+                if self._password_oauth:
+                    self.oauth = self._password_oauth
+        # Auth expired, reconnect
+        await self.connect()
+
+    async def get(self, command, url, headers):
+        """GET data from API"""
+        key, cached = self._cache_lookup(command, url, headers)
+        if cached is not None:
+            return cached
+        await self.validate_token()
+        headers = self._auth_headers(headers)
+        url = f"{url}/{command}"
+        if self._inflight is not None:
+            result = await self._inflight.do((url, headers.get("Accept")),
+                                             lambda: self._request(url, headers=headers, method="GET"))
+        else:
+            result = await self._request(url, headers=headers, method="GET")
+        if key is not None:
+            self.response_cache.put(key, _endpoint(command), result)
+        return result
+
+    async def post(self, command, url, headers, data=None):
+        """POST data to API"""
+        await self.validate_token()
+        headers = self._auth_headers(headers)
+        result = await self._request(f"{url}/{command}", headers=headers, data=data, method="POST")
+        self._cache_invalidate(command, url)
+        return result
+
+    async def delete(self, command, url, headers):
+        """DELETE data from api"""
+        await self.validate_token()
+        headers = self._auth_headers(headers)
+        if headers["Accept"]:
+            del headers["Accept"]
+        result = await self._request(url=f"{url}/{command}", headers=headers, method="DELETE")
+        self._cache_invalidate(command, url)
+        return result
+
+    async def connect(self):
+        """Connect to JLR API"""
+        logger.info("Connecting...")
+        with self.span("login"):
+            auth = await self._authenticate(data=self.oauth)
+            self._register_auth(auth)
+            self._set_header(auth['access_token'])
+            logger.info("[+] authenticated")
+            await self._register_device_and_log_in()
+
+    async def _register_device_and_log_in(self):
+        await self._register_device(self.head)
+        logger.info("1/2 device id registered")
+        await self._login_user(self.head)
+        logger.info("2/2 user logged in, user id retrieved")
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_maxsize)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=TIMEOUT))
+        return self._session
+
+    async def _reserve(self, request_class):
+        """Reserve a rate limiter slot. Backends other than the in-memory one may block on
+        I/O, e.g. sqlite waiting for another process' lock, so they run in the default executor"""
+        if isinstance(self.rate_limiter.backend, MemoryRateLimitBackend):
+            return self.rate_limiter.reserve(self._rate_limit_account(), request_class)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.rate_limiter.reserve, self._rate_limit_account(), request_class)
+
+    async def _request(self, url, headers=None, data=None, method="GET"):
+        breaker = self.breaker(url)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                wait = await self._reserve(_request_class(method, url))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(f"{method} {url} refused, circuit open for {_host(url)}", url=url)
+            start = time.monotonic()
+            try:
+                async with self._get_session().request(method, url, headers=headers, json=data) as ret:
+                    body = await ret.read()
+                    text = body.decode(ret.get_encoding()) if body else ""
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                error = APIConnectionError(f"{method} {url} failed: {err!r}", url=url,
+                                           latency=time.monotonic() - start)
+                self._record(method, url, error.latency, None, 0, 0, error)
+            except BaseException:
+                # Other errors and cancellation say nothing about the host
+                if breaker is not None:
+                    breaker.release()
+                raise
+            else:
+                latency = time.monotonic() - start
+                error = None
+                if ret.status >= 400:
+                    error = APIStatusError(f"{method} {url} returned {ret.status}: {text[:200]}",
+                                           status_code=ret.status, url=url, latency=latency,
+                                           response=TransportResponse(ret.status, text, ret.headers,
+                                                                      bytes_received=len(body)))
+                self._record(method, url, latency, ret.status, len(json.dumps(data)) if data is not None else 0,
+                             len(body), error)
+                if error is None:
+                    if breaker is not None:
+                        breaker.record_success()
+                    return _parse_body(text)
+            if breaker is not None:
+                if _is_host_failure(error):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if not self.retry_policy.should_retry(method, error, attempt):
+                raise error
+            delay = self.retry_policy.delay(attempt, error)
+            logger.debug("%s, retrying in %.2fs", error, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _authenticate(self, data=None):
+        """Raw urlopen command to the auth url"""
+        url = f"{self.base.IFAS}/tokens/tokensSSO"
+        auth_headers = {
+            "Authorization": "Basic YXM6YXNwYXNz",
+            "Content-Type": "application/json",
+            "user-agent": "jlrpy"}
+
+        return await self._request(url, auth_headers, data, "POST")
+
+    async def _register_device(self, headers=None):
+        """Register the device Id"""
+        url = f"{self.base.IFOP}/users/{self.email}/clients"
+        data = {
+            "access_token": self.access_token,
+            "authorization_token": self.auth_token,
+            "expires_in": "86400",
+            "deviceID": self.device_id
+        }
+
+        return await self._request(url, headers, data, "POST")
+
+    async def _login_user(self, headers=None):
+        """Login the user"""
+        url = f"{self.base.IF9}/users?loginName={self.email}"
+        user_login_header = headers.copy()
+        user_login_header["Accept"] = "application/vnd.wirelesscar.ngtp.if9.User-v3+json"
+
+        user_data = await self._request(url, user_login_header)
+        self.user_id = user_data['userId']
+        return user_data
+
+    async def refresh_tokens(self):
+        """Refresh tokens."""
+        self.oauth = {
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token}
+
+        with self.span("token_refresh"):
+            auth = await self._authenticate(self.oauth)
+            self._register_auth(auth)
+            self._set_header(auth['access_token'])
+            logger.info("[+] Tokens refreshed")
+            await self._register_device_and_log_in()
+
+    async def get_vehicles(self, headers):
+        """Get vehicles for user"""
+        url = f"{self.base.IF9}/users/{self.user_id}/vehicles?primaryOnly=true"
+        return await self._request(url, headers)
+
+    async def get_user_info(self):
+        """Get user information"""
+        headers = self.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.User-v3+json"
+        headers["Content-Type"] = "application/json"
+        return await self.get("", f"{self.base.IF9}/users?loginName={self.email}", headers)
+
+    async def update_user_info(self, user_info_data):
+        """Update user information"""
+        headers = self.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.User-v3+json; charset=utf-8"
+        return await self.post(self.user_id, f"{self.base.IF9}/users", headers, user_info_data)
+
+    async def reverse_geocode(self, lat, lon):
+        """Get geocode information"""
+        if self.geocode_cache is not None:
+            cached = self.geocode_cache.get(lat, lon)
+            if cached is not None:
+                return cached
+        headers = self.head.copy()
+        headers["Accept"] = "application/json"
+        result = await self.get("en", f"{self.base.IF9}/geocode/reverse/{lat}/{lon}", headers)
+        if self.geocode_cache is not None:
+            self.geocode_cache.put(lat, lon, result)
+        return result
+
+
+class AsyncVehicle(Vehicle):
+    """Asyncio vehicle class.
+
+    Exposes the same methods as Vehicle as coroutines. Methods that only issue a single
+    request are inherited unchanged and return the awaitable from get/post/delete.
+    iter_trips and iter_route_points return async iterators.
+    """
+
+    async def post(self, command, headers, data):
+        """Utility command to post data to VHS"""
+        try:
+            return await self.connection.post(command, f"{self.connection.base.IF9}/vehicles/{self.vin}",
+                                              headers, data)
+        except APIStatusError as err:
+            self._check_service_token(data, err)
+            raise
+
+    async def _authenticate_service(self, pin, service_name):
+        """Authenticate to specified service with the provided PIN"""
+        cached = self._cached_service_token(pin, service_name)
+        if cached is not None:
+            return cached
+
+        data = {
+            "serviceName": service_name,
+            "pin": str(pin)
+        }
+        headers = self.connection.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.AuthenticateRequest-v2+json; charset=utf-8"
+        with self.connection.span("service_auth", service=service_name):
+            token = await self.post(f"users/{self.connection.user_id}/authenticate", headers, data)
+        self._cache_service_token(pin, service_name, token)
+        return token
+
+    async def get_status(self, key=None, structured=False):
+        """Get vehicle status"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.ngtp.org.if9.healthstatus-v4+json"
+        result = await self.get('status?includeInactive=true', headers)
+
+        if key:
+            return VehicleStatus(result)[key]
+        if structured:
+            return VehicleStatus(result)
+
+        return result
+
+    async def refresh_status(self, max_age=STATUS_MAX_AGE, timeout=SERVICE_TIMEOUT):
+        """Get the vehicle status as a VehicleStatus no older than max_age seconds"""
+        status = await self.get_status(structured=True)
+        if not status.is_stale(max_age):
+            return status
+        try:
+            await self.wait_for_service(await self.get_health_status(), timeout)
+        except ServiceTimeoutError as err:
+            logger.warning("Health status update of %s did not finish: %s", self.vin, err)
+        return await self.get_status(structured=True)
+
+    async def get_health_status(self):
+        """Get vehicle health status"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v4+json"
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json; charset=utf-8"  # noqa: E501, pylint: disable=line-too-long
+
+        vhs_data = await self._authenticate_vhs()
+
+        return await self.post('healthstatus', headers, vhs_data)
+
+    _pages = staticmethod(_aiter_pages)
+
+    async def _trip_page(self, start, count, cursor):
+        stop, seen = cursor
+        return _next_trip_page((await self.get_trips(count, start, stop)).get("trips") or [], count, seen)
+
+    async def _route_page(self, trip_id, page_size, page):
+        waypoints = (await self.get_trip(trip_id, page, page_size) or {}).get("waypoints") or []
+        return waypoints, page + 1 if len(waypoints) >= page_size else None
+
+    async def get_route(self, trip_id):
+        """Get the complete route of a finished trip, from the connection route_store if cached"""
+        store = self.connection.route_store
+        route = store.get(self.vin, trip_id) if store is not None else None
+        if route is None:
+            waypoints, page = [], 1
+            while page is not None:
+                items, page = await self._route_page(trip_id, ROUTE_PAGE_SIZE, page)
+                waypoints.extend(items)
+            route = _route(self.vin, trip_id, waypoints)
+            if store is not None:
+                store.put(self.vin, trip_id, route)
+        return route
+
+    async def download_routes(self, trip_ids, max_workers=ROUTE_WORKERS):
+        """Download the routes of finished trips into the connection route_store"""
+        semaphore = asyncio.Semaphore(max_workers)
+        errors = {}
+
+        async def download(trip_id):
+            async with semaphore:
+                try:
+                    await self.get_route(trip_id)
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.warning("Unable to download route of trip %s: %s", trip_id, err)
+                    errors[trip_id] = err
+
+        await asyncio.gather(*(download(trip_id) for trip_id in self._missing_routes(trip_ids)))
+        return errors
+
+    async def wait_for_service(self, service, timeout=SERVICE_TIMEOUT, min_interval=SERVICE_POLL_MIN,
+                               max_interval=SERVICE_POLL_MAX):
+        """Wait for a service to finish and return its final status. Gather many waits to share the event loop"""
+        status = service if isinstance(service, dict) else None
+        service_id = _service_id(service)
+        start = time.monotonic()
+        delay = min_interval
+        while status is None or status.get("status") not in SERVICE_TERMINAL_STATES:
+            elapsed = time.monotonic() - start
+            if elapsed >= timeout:
+                raise ServiceTimeoutError(f"Service {service_id} of {self.vin} not finished after {elapsed:.0f}s",
+                                          status=status)
+            await asyncio.sleep(min(delay, timeout - elapsed))
+            try:
+                status = await self.get_service_status(service_id)
+            except APIStatusError as err:
+                if err.status_code is not None and err.status_code < 500:
+                    raise
+            except requests.RequestException:
+                pass
+            delay = _service_poll_delay(time.monotonic() - start, min_interval, max_interval)
+        return status
+
+    async def get_rcc_target_value(self):
+        """Get Remote Climate Target Value"""
+        headers = self.connection.head.copy()
+        try:
+            return await self.get('settings/ClimateControlRccTargetTemp', headers)
+        except HTTPError:
+            return None
+
+    async def lock(self, pin):
+        """Lock vehicle. Requires personal PIN for authentication"""
+        headers = self.connection.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json"
+        rdl_data = await self.authenticate_rdl(pin)
+
+        return await self.post("lock", headers, rdl_data)
+
+    async def unlock(self, pin):
+        """Unlock vehicle. Requires personal PIN for authentication"""
+        headers = self.connection.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json"
+        rdu_data = await self.authenticate_rdu(pin)
+
+        return await self.post("unlock", headers, rdu_data)
+
+    async def reset_alarm(self, pin):
+        """Reset vehicle alarm"""
+        headers = self.connection.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json; charset=utf-8"  # noqa: E501, pylint: disable=line-too-long
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v4+json"
+        aloff_data = await self.authenticate_aloff(pin)
+
+        return await self.post("unlock", headers, aloff_data)
+
+    async def honk_blink(self):
+        """Sound the horn and blink lights"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v4+json"
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json; charset=utf-8"  # noqa: E501, pylint: disable=line-too-long
+
+        hblf_data = await self.authenticate_hblf()
+        return await self.post("honkBlink", headers, hblf_data)
+
+    async def remote_engine_start(self, pin, target_value):
+        """Start Remote Engine preconditioning"""
+        return (await self._remote_engine_start_pipeline(pin, target_value).run())["engine_on"]
+
+    async def _engine_on(self, pin):
+        headers = self.connection.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json"
+        reon_data = await self.authenticate_reon(pin)
+
+        return await self.post("engineOn", headers, reon_data)
+
+    async def climate_start(self, target_temp, priority=None):
+        """Start climate preconditioning, setting the climate priority first if given"""
+        return (await self._climate_start_pipeline(target_temp, priority).run())["preconditioning"]
+
+    async def lock_and_check(self, pin, timeout=SERVICE_TIMEOUT):
+        """Lock the vehicle, wait for the lock service to finish and read the resulting status"""
+        return await self._lock_and_check_pipeline(pin, timeout).run()
+
+    def pipeline(self, pin=None, max_workers=PIPELINE_WORKERS):
+        """Return an empty AsyncCommandPipeline for this vehicle"""
+        return AsyncCommandPipeline(self, pin, max_workers)
+
+    async def _prefetch_service_token(self, service_name, pin):
+        pin = self._service_pin(service_name, pin)
+        return self._share_pipeline_token(service_name, pin, await self._authenticate_service(pin, service_name))
+
+    async def remote_engine_stop(self, pin):
+        """Stop Remote Engine preconditioning"""
+        headers = self.connection.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json"
+        reoff_data = await self.authenticate_reoff(pin)
+
+        return await self.post("engineOff", headers, reoff_data)
+
+    async def set_rcc_target_value(self, pin, target_value):
+        """Set Remote Climate Target Value (value between 31-57, 31 is LO 57 is HOT)"""
+        await self.enable_provisioning_mode(pin)
+        await self._post_rcc_target_value(target_value)
+
+    async def _post_rcc_target_value(self, target_value):
+        headers = self.connection.head.copy()
+        service_parameters = {
+            "key": "ClimateControlRccTargetTemp",
+            "value": str(target_value),
+            "applied": 1
+        }
+        await self.post("settings", headers, service_parameters)
+
+    async def _preconditioning_control(self, service_parameters):
+        """Control the climate preconditioning"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v5+json"
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.PhevService-v1+json; charset=utf-8"
+
+        ecc_data = await self.authenticate_ecc()
+        ecc_data['serviceParameters'] = service_parameters
+        return await self.post("preconditioning", headers, ecc_data)
+
+    async def update_charging_profile(self, timers=(), tariffs=(), replace_timers=False):
+        """Apply many departure timers and charging periods with as few chargeProfile requests as possible"""
+        current = await self.get_departure_timers() if timers or replace_timers else None
+        settings = _charging_profile_settings(current, timers, tariffs, replace_timers)
+        return await self._charging_profile_update(settings) if settings else []
+
+    async def _charging_profile_update(self, settings):
+        """Send several chargeProfile settings in one request, or one request each if that is rejected"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v5+json"
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.PhevService-v1+json; charset=utf-8"
+
+        cp_data = await self.authenticate_cp()
+        cp_data.update(settings)
+        try:
+            return [await self.post("chargeProfile", headers, cp_data)]
+        except APIStatusError as err:
+            if len(settings) < 2 or err.status_code not in CHARGE_PROFILE_REJECTED_STATUSES:
+                raise
+            logger.info("Combined chargeProfile request rejected (%s), sending settings separately", err.status_code)
+        return [await self._charging_profile_control(key, value) for key, value in settings.items()]
+
+    async def _charging_profile_control(self, service_parameter_key, service_parameters):
+        """Charging profile API"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.ServiceStatus-v5+json"
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.PhevService-v1+json; charset=utf-8"
+
+        cp_data = await self.authenticate_cp()
+        cp_data[service_parameter_key] = service_parameters
+
+        return await self.post("chargeProfile", headers, cp_data)
+
+    async def set_wakeup_time(self, wakeup_time):
+        """Set the wakeup time for the specified time (epoch milliseconds)"""
+        swu_data = await self.authenticate_swu()
+        swu_data["serviceCommand"] = "START"
+        swu_data["startTime"] = wakeup_time
+        return await self._swu(swu_data)
+
+    async def delete_wakeup_time(self):
+        """Stop the wakeup time"""
+        swu_data = await self.authenticate_swu()
+        swu_data["serviceCommand"] = "END"
+        return await self._swu(swu_data)
+
+    async def enable_provisioning_mode(self, pin):
+        """Enable provisioning mode """
+        await self._prov_command(pin, None, "provisioning")
+
+    async def _prov_command(self, pin, expiration_time, mode):
+        """Send prov endpoint commands. Used for service/transport/privacy mode"""
+        headers = self.connection.head.copy()
+        headers["Content-Type"] = "application/vnd.wirelesscar.ngtp.if9.StartServiceConfiguration-v3+json"
+        prov_data = await self.authenticate_prov(pin)
+
+        prov_data["serviceCommand"] = mode
+        prov_data["startTime"] = None
+        prov_data["endTime"] = expiration_time
+
+        return await self.post("prov", headers, prov_data)
+
+    async def _gm_command(self, pin, expiration_time, action):
+        """Send GM toggle command"""
+        headers = self.connection.head.copy()
+        headers["Accept"] = "application/vnd.wirelesscar.ngtp.if9.GuardianAlarmList-v1+json"
+        gm_data = await self.authenticate_gm(pin)
+        if action == "ACTIVATE":
+            gm_data["endTime"] = expiration_time
+            gm_data["status"] = "ACTIVE"
+            return await self.post("gm/alarms", headers, gm_data)
+        if action == "DEACTIVATE":
+            headers["X-servicetoken"] = gm_data.get("token")
+            return await self.delete("gm/alarms/INSTANT", headers)
@@ -15,6 +15,7 @@ setuptools.setup(
     url="https://github.com/ardevd/jlrpy",
     py_modules=['jlrpy'],
     install_requires=['requests>=2.26.0'],
+    extras_require={'async': ['aiohttp>=3.8'], 'numpy': ['numpy>=1.20']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
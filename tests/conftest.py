@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import jlrpy  # noqa: E402
+from mock_server import MockJLRServer  # noqa: E402
+
+EMAIL = "user@example.com"
+PASSWORD = "password"
+
+
+@pytest.fixture
+def server():
+    with MockJLRServer(vehicles=2) as mock:
+        yield mock
+
+
+@pytest.fixture
+def connection(server):
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls) as c:
+        yield c
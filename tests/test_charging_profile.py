@@ -0,0 +1,77 @@
+import asyncio
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+
+MONDAYS = {"monday": True}
+
+
+def current(*timers):
+    return {"departureTimerSetting": {"timers": list(timers)}}
+
+
+def test_new_timers_are_sent():
+    timer = jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS)
+    assert jlrpy._departure_timer_changes(current(), [timer], False) == [timer]
+    assert jlrpy._departure_timer_changes(None, [timer], False) == [timer]
+    assert jlrpy._departure_timer_changes({"departureTimerSetting": None}, [timer], False) == [timer]
+
+
+def test_unchanged_timers_are_skipped():
+    timer = jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS)
+    existing = dict(timer, extra="returned by the API")
+    assert jlrpy._departure_timer_changes(current(existing), [timer], False) == []
+
+
+def test_changed_timers_are_sent():
+    existing = jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS)
+    timer = jlrpy.departure_timer(1, 8, 0, schedule=MONDAYS)
+    assert jlrpy._departure_timer_changes(current(existing), [timer], False) == [timer]
+
+
+def test_replace_deletes_other_timers():
+    kept = jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS)
+    other = jlrpy.departure_timer(2, 9, 0, year=2026, month=1, day=1)
+    assert jlrpy._departure_timer_changes(current(kept, other), [kept], False) == []
+    assert jlrpy._departure_timer_changes(current(kept, other), [kept], True) == [{"timerIndex": 2}]
+
+
+def test_update_charging_profile_sends_only_changes(server, connection):
+    vehicle = connection.vehicles[0]
+    timers = [jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS), jlrpy.departure_timer(2, 8, 0, schedule=MONDAYS)]
+    assert len(vehicle.set_departure_timers(timers)) == 1
+    commands = server.endpoint_counts["command"]
+    assert vehicle.set_departure_timers(timers) == []
+    assert server.endpoint_counts["command"] == commands
+    vehicle.set_departure_timers(timers[:1], replace=True)
+    assert sorted(server.state.departure_timers[vehicle.vin]) == [1]
+
+
+def test_timers_and_tariffs_share_one_request(server, connection):
+    vehicle = connection.vehicles[0]
+    timers = [jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS)]
+    tariffs = [jlrpy.charging_period(1, MONDAYS, 0, 30, 8, 45)]
+    assert len(vehicle.update_charging_profile(timers=timers, tariffs=tariffs)) == 1
+    assert server.endpoint_counts["command"] == 1
+    assert sorted(server.state.departure_timers[vehicle.vin]) == [1]
+
+
+def test_rejected_combined_request_falls_back_to_one_request_each(server, connection):
+    server.state.reject_combined_charge_profile = True
+    vehicle = connection.vehicles[0]
+    timers = [jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS)]
+    tariffs = [jlrpy.charging_period(1, MONDAYS, 0, 30, 8, 45)]
+    assert len(vehicle.update_charging_profile(timers=timers, tariffs=tariffs)) == 2
+    assert server.endpoint_counts["command"] == 3
+    assert sorted(server.state.departure_timers[vehicle.vin]) == [1]
+
+
+def test_async_timers_and_tariffs_share_one_request(server):
+    async def main():
+        async with jlrpy.AsyncConnection(EMAIL, PASSWORD, base_urls=server.base_urls) as c:
+            return await c.vehicles[0].update_charging_profile(
+                timers=[jlrpy.departure_timer(1, 7, 30, schedule=MONDAYS)],
+                tariffs=[jlrpy.charging_period(1, MONDAYS, 0, 30, 8, 45)])
+
+    assert len(asyncio.run(main())) == 1
+    assert server.endpoint_counts["command"] == 1
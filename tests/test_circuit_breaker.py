@@ -0,0 +1,136 @@
+import sqlite3
+import time
+
+import pytest
+import requests
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+
+
+class StubTransport:
+    """Transport raising the queued exceptions, then answering 200"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def send(self, method, url, headers, data, timeout):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return jlrpy.TransportResponse(200, '{"ok": true}')
+
+    def close(self):
+        pass
+
+
+def stub_connection(transport, threshold=3, reset=0.05):
+    c = jlrpy.Connection(EMAIL, PASSWORD, lazy=True, transport=transport, retry_policy=jlrpy.RetryPolicy(retries=0),
+                         circuit_breaker_threshold=threshold, circuit_breaker_reset=reset)
+    c.expiration = time.time() + 3600
+    return c
+
+
+URL = "https://if9.example.com/if9/jlr/vehicles/VIN/status"
+
+
+def test_breaker_opens_after_threshold_and_closes_after_trial():
+    breaker = jlrpy.CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+
+
+def test_failed_trial_reopens_breaker():
+    breaker = jlrpy.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+
+
+def test_unreported_trial_expires():
+    breaker = jlrpy.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_connection_errors_open_circuit():
+    transport = StubTransport([requests.ConnectionError("down")] * 3)
+    c = stub_connection(transport)
+    for _ in range(3):
+        with pytest.raises(jlrpy.APIConnectionError):
+            c._request(URL)
+    with pytest.raises(jlrpy.CircuitOpenError):
+        c._request(URL)
+    assert transport.calls == 3
+    time.sleep(0.06)
+    assert c._request(URL) == {"ok": True}
+    assert c.breaker(URL).state == jlrpy.CircuitBreaker.CLOSED
+
+
+def test_unexpected_error_on_trial_does_not_stick_half_open():
+    transport = StubTransport([requests.ConnectionError("down")] * 3 + [requests.exceptions.ChunkedEncodingError()])
+    c = stub_connection(transport)
+    for _ in range(3):
+        with pytest.raises(jlrpy.APIConnectionError):
+            c._request(URL)
+    time.sleep(0.06)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        c._request(URL)
+    assert c.breaker(URL).state == jlrpy.CircuitBreaker.OPEN
+    assert c._request(URL) == {"ok": True}
+    assert c.breaker(URL).state == jlrpy.CircuitBreaker.CLOSED
+
+
+def test_local_errors_do_not_open_circuit():
+    transport = StubTransport([RuntimeError("transport bug")] * 5)
+    c = stub_connection(transport)
+    for _ in range(5):
+        with pytest.raises(RuntimeError):
+            c._request(URL)
+    assert c.breaker(URL).state == jlrpy.CircuitBreaker.CLOSED
+    assert c._request(URL) == {"ok": True}
+
+
+class BrokenBackend:
+    def reserve(self, key, rate, capacity):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_rate_limiter_errors_do_not_open_circuit():
+    transport = StubTransport([])
+    c = stub_connection(transport)
+    c.rate_limiter = jlrpy.RateLimiter(backend=BrokenBackend())
+    for _ in range(5):
+        with pytest.raises(sqlite3.OperationalError):
+            c._request(URL)
+    assert transport.calls == 0
+    assert c.breaker(URL).state == jlrpy.CircuitBreaker.CLOSED
+
+
+def test_server_errors_open_circuit(server):
+    server.state.error_rate = 1.0
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, lazy=True,
+                          retry_policy=jlrpy.RetryPolicy(retries=0), circuit_breaker_threshold=2) as c:
+        for _ in range(2):
+            with pytest.raises(jlrpy.APIError):
+                c.validate_token()
+        with pytest.raises(jlrpy.CircuitOpenError):
+            c.validate_token()
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+from mock_server import MockJLRServer
+
+
+def test_concurrent_gets_share_one_request():
+    with MockJLRServer(latency=0.1) as server:
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls) as c:
+            vehicle = c.vehicles[0]
+            with ThreadPoolExecutor(8) as pool:
+                results = list(pool.map(lambda _: vehicle.get_status(), range(8)))
+            assert server.endpoint_counts["status"] == 1
+    assert all(result == results[0] for result in results)
+    assert len({id(result) for result in results}) == len(results)
+
+
+def test_leader_changes_are_not_shared():
+    flight = jlrpy._SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def func():
+        started.set()
+        release.wait()
+        return {"items": [1]}
+
+    followers = []
+
+    def follower():
+        followers.append(flight.do("key", func))
+
+    def leader():
+        flight.do("key", func)["items"].append(2)
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    started.wait()
+    threads = [threading.Thread(target=follower) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in [leader_thread] + threads:
+        thread.join()
+    assert followers == [{"items": [1]}] * 4
+
+
+class Body(dict):
+    """Response body counting its deep copies"""
+
+    copies = 0
+
+    def __deepcopy__(self, memo):
+        Body.copies += 1
+        return Body(self)
+
+
+def test_result_is_not_copied_without_followers():
+    flight = jlrpy._SingleFlight()
+    body = Body(items=1)
+    Body.copies = 0
+    assert flight.do("key", lambda: body) is body
+    assert Body.copies == 0
+
+
+def test_followers_get_one_copy_each():
+    flight = jlrpy._SingleFlight()
+    release = threading.Event()
+    body = Body(items=1)
+    Body.copies = 0
+
+    def func():
+        release.wait()
+        return body
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", func))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while "key" not in flight._calls or flight._calls["key"].waiters < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert Body.copies == 3
+    assert results.count(body) == 4
+    assert len({id(result) for result in results}) == 4
+    assert sum(result is body for result in results) == 1
+
+
+def test_async_result_is_not_copied_without_followers():
+    async def main():
+        flight = jlrpy._AsyncSingleFlight()
+        body = Body(items=1)
+        Body.copies = 0
+
+        async def func():
+            return body
+
+        assert await flight.do("key", func) is body
+        assert Body.copies == 0
+
+    asyncio.run(main())
+
+
+def test_errors_are_shared():
+    flight = jlrpy._SingleFlight()
+
+    def func():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("key", func)
+    assert not flight._calls
+
+
+def test_async_leader_cancellation_does_not_cancel_followers():
+    async def main():
+        flight = jlrpy._AsyncSingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await release.wait()
+            return {"items": [1]}
+
+        leader = asyncio.ensure_future(flight.do("key", func))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", func))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == {"items": [1]}
+        assert leader.cancelled()
+        assert len(calls) == 1
+        await asyncio.sleep(0)
+        assert not flight._calls
+
+    asyncio.run(main())
+
+
+def test_async_followers_get_copies():
+    async def main():
+        flight = jlrpy._AsyncSingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.01)
+            return {"items": [1]}
+
+        results = await asyncio.gather(*(flight.do("key", func) for _ in range(4)))
+        results[0]["items"].append(2)
+        assert results[1:] == [{"items": [1]}] * 3
+
+    asyncio.run(main())
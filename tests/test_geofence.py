@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+import jlrpy
+from mock_server import MockJLRServer
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(jlrpy, "numpy", None)
+    return request.param
+
+
+def random_fences(rng, count):
+    fences = []
+    for i in range(count):
+        lat, lon = rng.uniform(59.0, 60.0), rng.uniform(10.0, 11.0)
+        if i % 2:
+            fences.append(jlrpy.CircleFence(f"circle-{i}", lat, lon, rng.uniform(100, 20000)))
+        else:
+            size = rng.uniform(0.01, 0.2)
+            points = [(lat, lon), (lat + size, lon + size / 2), (lat + size / 3, lon + size),
+                      (lat - size / 4, lon + size / 3)]
+            fences.append(jlrpy.PolygonFence(f"polygon-{i}", points))
+    return fences
+
+
+def test_classify_many_matches_brute_force(backend):
+    rng = random.Random(1)
+    fences = random_fences(rng, 60)
+    index = jlrpy.GeofenceIndex(fences)
+    positions = {f"VIN{i}": (rng.uniform(58.9, 60.1), rng.uniform(9.9, 11.1)) for i in range(2000)}
+    positions["clustered"] = (59.5, 10.5)
+    positions.update({f"NEAR{i}": (59.5 + i * 1e-5, 10.5) for i in range(50)})
+    expected = {key: frozenset(fence.name for fence in fences if fence.contains(*position))
+                for key, position in positions.items()}
+    assert index.classify_many(positions) == expected
+    assert all(index.classify(*position) == expected[key] for key, position in positions.items())
+    assert any(expected.values())
+
+
+def test_classify_many_accepts_positions_and_skips_invalid():
+    index = jlrpy.GeofenceIndex([jlrpy.CircleFence("home", 59.9139, 10.7522, 100)])
+    with MockJLRServer() as server:
+        with jlrpy.Connection("user@example.com", "password", base_urls=server.base_urls) as c:
+            position = c.vehicles[0].get_position()
+    result = index.classify_many({"mock": position, "away": (0.0, 0.0), "broken": {"position": {}}})
+    assert result == {"mock": frozenset({"home"}), "away": frozenset()}
+
+
+def test_index_remove_and_replace():
+    index = jlrpy.GeofenceIndex([jlrpy.CircleFence("home", 59.9, 10.7, 100)])
+    assert index.classify(59.9, 10.7) == {"home"}
+    index.add(jlrpy.CircleFence("home", 60.5, 10.7, 100))
+    assert index.classify(59.9, 10.7) == frozenset()
+    index.remove("home")
+    assert index.classify(60.5, 10.7) == frozenset()
+    assert not index._cells
+
+
+def test_monitor_reports_enter_and_exit():
+    index = jlrpy.GeofenceIndex([jlrpy.CircleFence("home", 59.9, 10.7, 500),
+                                 jlrpy.CircleFence("garage", 59.9, 10.7, 50)])
+    monitor = jlrpy.GeofenceMonitor(index)
+    events = monitor.update({"A": (59.9, 10.7), "B": (61.0, 10.7)})
+    assert [(e.vin, e.fence, e.event) for e in events] == [("A", "garage", "enter"), ("A", "home", "enter")]
+    assert monitor.update({"A": (59.9, 10.7), "B": (61.0, 10.7)}) == []
+    events = monitor.update({"A": (59.902, 10.7), "B": (59.9, 10.7)})
+    assert [(e.vin, e.fence, e.event) for e in events] == [("A", "garage", "exit"), ("B", "garage", "enter"),
+                                                         ("B", "home", "enter")]
+    events = monitor.update({"A": (61.0, 10.7)})
+    assert [(e.vin, e.fence, e.event) for e in events] == [("A", "home", "exit")]
+    assert events[0].latitude == 61.0
+
+
+def test_polygon_needs_three_points():
+    with pytest.raises(ValueError):
+        jlrpy.PolygonFence("line", [(0, 0), (1, 1)])
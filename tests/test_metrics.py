@@ -0,0 +1,64 @@
+import pytest
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+
+
+def test_connection_records_requests_and_phases(server):
+    metrics = jlrpy.Metrics()
+    spans = []
+    metrics.add_span_callback(lambda name, start, duration, attributes: spans.append((name, attributes)))
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, metrics=metrics,
+                          retry_policy=jlrpy.RetryPolicy(retries=0)) as c:
+        vehicle = c.vehicles[0]
+        vehicle.get_status()
+        vehicle.get_status()
+        server.state.error_rate = 1.0
+        with pytest.raises(jlrpy.APIStatusError):
+            vehicle.get_position()
+    snapshot = metrics.snapshot()
+    status = snapshot["endpoints"]["status"]
+    assert status["count"] == 2 and status["errors"] == 0
+    assert status["bytes_received"] > 0
+    assert status["buckets"][float("inf")] == 2
+    assert snapshot["endpoints"]["position"]["errors"] == 1
+    assert snapshot["endpoints"]["position"]["error_rate"] == 1.0
+    assert snapshot["phases"]["login"]["count"] == 1
+    names = [name for name, _ in spans]
+    assert "jlrpy.status" in names and "jlrpy.login" in names
+    assert dict(spans)["jlrpy.position"]["http.status_code"] == 503
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = jlrpy.Metrics(buckets=(0.1, 1.0))
+    for latency in (0.05, 0.5, 0.5, 5.0):
+        metrics.record_request("GET", "https://example.com/if9/jlr/vehicles/VIN/status", latency)
+    stats = metrics.snapshot()["endpoints"]["status"]
+    assert stats["buckets"] == {0.1: 1, 1.0: 3, float("inf"): 4}
+    assert stats["latency_sum"] == pytest.approx(6.05)
+    metrics.reset()
+    assert metrics.snapshot() == {"endpoints": {}, "phases": {}}
+
+
+def test_prometheus_export():
+    metrics = jlrpy.Metrics(buckets=(0.1, 1.0))
+    metrics.record_request("GET", "https://example.com/if9/jlr/vehicles/VIN/status", 0.5, 200, 10, 100)
+    metrics.record_request("GET", "https://example.com/if9/jlr/vehicles/VIN/status", 2.0, 503, error=True)
+    with metrics.span("login"):
+        pass
+    lines = metrics.to_prometheus().splitlines()
+    assert "# TYPE jlrpy_requests_total counter" in lines
+    assert 'jlrpy_requests_total{endpoint="status"} 2' in lines
+    assert 'jlrpy_request_errors_total{endpoint="status"} 1' in lines
+    assert 'jlrpy_request_bytes_total{endpoint="status",direction="received"} 100' in lines
+    assert 'jlrpy_request_duration_seconds_bucket{endpoint="status",le="1.0"} 1' in lines
+    assert 'jlrpy_request_duration_seconds_bucket{endpoint="status",le="+Inf"} 2' in lines
+    assert 'jlrpy_request_duration_seconds_count{endpoint="status"} 2' in lines
+    assert 'jlrpy_phase_duration_seconds_count{phase="login"} 1' in lines
+
+
+def test_failing_span_callback_is_ignored():
+    metrics = jlrpy.Metrics()
+    metrics.add_span_callback(lambda *args: 1 / 0)
+    metrics.record_request("GET", "https://example.com/if9/jlr/vehicles/VIN/status", 0.1)
+    assert metrics.snapshot()["endpoints"]["status"]["count"] == 1
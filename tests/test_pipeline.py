@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+import pytest
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+
+PIN = "1234"
+
+
+def test_pipeline_runs_steps_in_dependency_order(connection):
+    vehicle = connection.vehicles[0]
+    order = []
+    results = (vehicle.pipeline()
+               .add("first", lambda: order.append("first") or 1)
+               .add("second", lambda value: order.append("second") or value + 1, jlrpy.CommandPipeline.result("first"))
+               .run())
+    assert results == {"first": 1, "second": 2}
+    assert order == ["first", "second"]
+
+
+def test_pipeline_rejects_circular_dependencies(connection):
+    pipeline = connection.vehicles[0].pipeline().add("a", lambda: 1, after=("b",)).add("b", lambda: 2, after=("a",))
+    with pytest.raises(ValueError):
+        pipeline.run()
+
+
+def test_pipeline_authenticates_each_service_once(server, connection):
+    vehicle = connection.vehicles[0]
+    result = vehicle.lock_and_check(PIN)
+    assert result["status"] is not None
+    assert server.endpoint_counts["authenticate"] == 1
+
+
+def test_pipeline_tokens_are_not_visible_outside_the_run(server, connection):
+    vehicle = connection.vehicles[0]
+    started = threading.Event()
+    release = threading.Event()
+
+    def step():
+        started.set()
+        release.wait()
+        return vehicle._cached_service_token(PIN, "RDL")
+
+    pipeline = vehicle.pipeline(PIN).add("step", step, services=("RDL",))
+    runner = threading.Thread(target=pipeline.run)
+    runner.start()
+    started.wait()
+    try:
+        assert vehicle._cached_service_token(PIN, "RDL") is None
+        vehicle.lock(PIN)
+        assert server.endpoint_counts["authenticate"] == 2
+    finally:
+        release.set()
+        runner.join()
+    assert pipeline.results["step"]["token"]
+
+
+def test_overlapping_pipelines_keep_their_tokens(connection):
+    vehicle = connection.vehicles[0]
+    started = threading.Event()
+    release = threading.Event()
+
+    def wait():
+        started.set()
+        release.wait()
+
+    slow = (vehicle.pipeline(PIN)
+            .add("wait", wait, services=("RDL",))
+            .add("token", vehicle._cached_service_token, PIN, "RDL", after=("wait",)))
+    runner = threading.Thread(target=slow.run)
+    runner.start()
+    started.wait()
+    try:
+        vehicle.pipeline(PIN).add("lock", vehicle.lock, PIN, services=("RDL",)).run()
+    finally:
+        release.set()
+        runner.join()
+    assert slow.results["token"]["token"]
+
+
+def test_async_pipeline_tokens_are_scoped_to_the_run(server):
+    async def main():
+        async with jlrpy.AsyncConnection(EMAIL, PASSWORD, base_urls=server.base_urls) as c:
+            vehicle = c.vehicles[0]
+            started = asyncio.Event()
+            release = asyncio.Event()
+
+            async def step():
+                started.set()
+                await release.wait()
+                return vehicle._cached_service_token(PIN, "RDL")
+
+            pipeline = vehicle.pipeline(PIN).add("step", step, services=("RDL",))
+            run = asyncio.ensure_future(pipeline.run())
+            await started.wait()
+            outside = vehicle._cached_service_token(PIN, "RDL")
+            release.set()
+            return outside, (await run)["step"]
+
+    outside, inside = asyncio.run(main())
+    assert outside is None
+    assert inside["token"]
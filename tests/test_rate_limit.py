@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+import pytest
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+
+
+class RecordingBackend(jlrpy.SqliteRateLimitBackend):
+    """Sqlite backend remembering the threads it was called from"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+
+    def reserve(self, key, rate, capacity):
+        self.threads.add(threading.get_ident())
+        return super().reserve(key, rate, capacity)
+
+
+def test_limits_account_requests(tmp_path):
+    limiter = jlrpy.RateLimiter(limits={"account": (10, 2)},
+                                backend=jlrpy.SqliteRateLimitBackend(str(tmp_path / "limits.db")))
+    assert limiter.reserve(EMAIL, "read") == 0
+    assert limiter.reserve(EMAIL, "read") == 0
+    assert limiter.reserve(EMAIL, "read") > 0
+
+
+def test_async_sqlite_backend_runs_off_the_event_loop(server, tmp_path):
+    backend = RecordingBackend(str(tmp_path / "limits.db"))
+    limiter = jlrpy.RateLimiter(backend=backend)
+
+    async def main():
+        async with jlrpy.AsyncConnection(EMAIL, PASSWORD, base_urls=server.base_urls, rate_limiter=limiter) as c:
+            await c.vehicles[0].get_status()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert backend.threads
+    assert loop_thread not in backend.threads
+
+
+def test_zero_rate_is_rejected():
+    with pytest.raises(ValueError):
+        jlrpy.RateLimiter(limits={"account": (0, 5)})
+    with pytest.raises(ValueError):
+        jlrpy.RateLimiter(limits={"read": (-1, 5)})
+
+
+def test_refresh_token_connections_do_not_share_a_bucket(server):
+    first, second = (jlrpy.Connection(refresh_token="token", base_urls=server.base_urls, lazy=True)
+                     for _ in range(2))
+    assert first._rate_limit_account() != second._rate_limit_account()
+    first.user_id = "user-1"
+    assert first._rate_limit_account() == "user-1"
+    assert jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, lazy=True)._rate_limit_account() == EMAIL
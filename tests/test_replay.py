@@ -0,0 +1,71 @@
+import json
+import time
+
+import pytest
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+from mock_server import MockJLRServer
+
+
+def record_session(path, latency=0.0):
+    with MockJLRServer(latency=latency) as server:
+        transport = jlrpy.RecordingTransport(str(path))
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, transport=transport) as c:
+            vehicle = c.vehicles[0]
+            recorded = {"status": vehicle.get_status(), "position": vehicle.get_position(),
+                        "attributes": vehicle.get_attributes()}
+        return server.base_urls, recorded
+
+
+@pytest.mark.parametrize("name", ["session.jsonl", "session.jsonl.gz"])
+def test_replay_round_trip(tmp_path, name):
+    base_urls, recorded = record_session(tmp_path / name)
+    transport = jlrpy.ReplayTransport(str(tmp_path / name))
+    assert [record["status"] for record in transport.records if "status" in record["url"]] == [200]
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=base_urls, transport=transport,
+                          retry_policy=jlrpy.RetryPolicy(retries=0)) as c:
+        vehicle = c.vehicles[0]
+        assert vehicle.get_status() == recorded["status"]
+        assert vehicle.get_position() == recorded["position"]
+        assert vehicle.get_attributes() == recorded["attributes"]
+        # The last recorded response is repeated
+        assert vehicle.get_status() == recorded["status"]
+        with pytest.raises(jlrpy.APIConnectionError):
+            vehicle.get_trips()
+
+
+def test_replay_speed_reproduces_latency(tmp_path):
+    path = tmp_path / "session.jsonl"
+    base_urls, _ = record_session(path, latency=0.05)
+    durations = {}
+    for speed in (None, 1):
+        transport = jlrpy.ReplayTransport(str(path), speed=speed)
+        start = time.monotonic()
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=base_urls, transport=transport) as c:
+            c.vehicles[0].get_status()
+            c.vehicles[0].get_position()
+            c.vehicles[0].get_attributes()
+        durations[speed] = time.monotonic() - start
+    recorded = transport.records[-1]["offset"] + transport.records[-1]["elapsed"]
+    assert durations[1] >= recorded
+    assert durations[None] < recorded / 2
+
+
+def test_retry_after_is_recorded_and_replayed(tmp_path):
+    path = tmp_path / "session.jsonl"
+    with MockJLRServer() as server:
+        transport = jlrpy.RecordingTransport(str(path))
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, transport=transport,
+                              retry_policy=jlrpy.RetryPolicy(retries=0)) as c:
+            server.state.error_rate = 1.0
+            server.state.retry_after = 5
+            with pytest.raises(jlrpy.APIStatusError):
+                c.vehicles[0].get_status()
+    with open(path, encoding="utf-8") as log:
+        records = [json.loads(line) for line in log]
+    assert records[-1]["status"] == 503 and records[-1]["retry_after"] == "5"
+    response = jlrpy.ReplayTransport(str(path)).send("GET", records[-1]["url"], {"Accept": records[-1]["accept"]},
+                                                     None, 1)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
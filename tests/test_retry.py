@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+
+
+class RecordingRetryPolicy(jlrpy.RetryPolicy):
+    """Retry policy remembering the delays it asked for, without sleeping"""
+
+    def __init__(self):
+        super().__init__(retries=1, backoff=0.001, max_backoff=30)
+        self.delays = []
+
+    def delay(self, attempt, error=None):
+        self.delays.append(super().delay(attempt, error))
+        return 0
+
+
+def test_retry_after_is_honoured(server):
+    policy = RecordingRetryPolicy()
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, retry_policy=policy) as c:
+        server.state.error_rate = 1.0
+        server.state.retry_after = 7
+        with pytest.raises(jlrpy.APIStatusError):
+            c.vehicles[0].get_status()
+    assert policy.delays == [7]
+
+
+def test_async_retry_after_is_honoured(server):
+    policy = RecordingRetryPolicy()
+
+    async def main():
+        async with jlrpy.AsyncConnection(EMAIL, PASSWORD, base_urls=server.base_urls, retry_policy=policy) as c:
+            server.state.error_rate = 1.0
+            server.state.retry_after = 7
+            with pytest.raises(jlrpy.APIStatusError) as err:
+                await c.vehicles[0].get_status()
+            assert err.value.response.status_code == 503
+
+    asyncio.run(main())
+    assert policy.delays == [7]
@@ -0,0 +1,82 @@
+import math
+
+import pytest
+
+import jlrpy
+from mock_server import MockJLRServer
+
+BACKENDS = ["numpy", "array"]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(jlrpy, "numpy", None)
+    return request.param
+
+
+def trace_with_stop():
+    """Moves north for 20 points, stands still for 40 points (195s), then moves on for 20 points"""
+    latitude = [59.9 + i * 0.0001 for i in range(20)] + [59.902] * 40 + [59.902 + i * 0.0001 for i in range(1, 21)]
+    timestamp = [1600000000 + 5 * i for i in range(len(latitude))]
+    return jlrpy.RouteTrace(latitude, [10.7] * len(latitude), timestamp)
+
+
+def test_from_route(backend):
+    with MockJLRServer(route_points=300) as server:
+        with jlrpy.Connection("user@example.com", "password", base_urls=server.base_urls) as c:
+            trace = jlrpy.RouteTrace.from_route(c.vehicles[0].get_route(1))
+    assert len(trace) == 300
+    points = list(zip(trace.latitude, trace.longitude))
+    expected = sum(jlrpy.haversine(a, b) for a, b in zip(points, points[1:]))
+    assert trace.length() == pytest.approx(expected)
+    assert list(trace.speed[:3]) == [50.0] * 3
+
+
+def test_speeds(backend):
+    trace = jlrpy.RouteTrace([59.9, 59.9001, 59.9001], [10.7] * 3, [0, 5, 5])
+    speeds = list(trace.speeds())
+    assert speeds[0] == pytest.approx(jlrpy.haversine((59.9, 10.7), (59.9001, 10.7)) / 5)
+    assert math.isnan(speeds[1])
+
+
+def test_stops(backend):
+    stops = trace_with_stop().stops(speed_threshold=1.0, min_duration=120)
+    assert len(stops) == 1
+    stop = stops[0]
+    assert (stop.first, stop.last) == (20, 59)
+    assert stop.duration == 195
+    assert stop.latitude == pytest.approx(59.902)
+    assert trace_with_stop().stops(min_duration=300) == []
+
+
+def test_downsample(backend):
+    trace = trace_with_stop()
+    by_time = trace.downsample(interval=60)
+    assert len(by_time) == 8
+    assert by_time.timestamp[0] == trace.timestamp[0] and by_time.timestamp[-1] == trace.timestamp[-1]
+    by_distance = trace.downsample(distance=50)
+    assert by_distance.latitude[0] == trace.latitude[0] and by_distance.latitude[-1] == trace.latitude[-1]
+    assert len(by_distance) < len(trace)
+    assert len(trace.downsample()) == len(trace)
+
+
+def test_backends_agree(monkeypatch):
+    pytest.importorskip("numpy")
+    trace = trace_with_stop()
+    results = {}
+    for backend in BACKENDS:
+        if backend == "array":
+            monkeypatch.setattr(jlrpy, "numpy", None)
+            trace = jlrpy.RouteTrace(list(trace.latitude), list(trace.longitude), list(trace.timestamp))
+        results[backend] = (trace.length(), trace.stops(),
+                            [list(t.latitude) for t in (trace.downsample(distance=25), trace.downsample(interval=30))])
+    assert results["numpy"][0] == pytest.approx(results["array"][0])
+    assert results["numpy"][1:] == results["array"][1:]
+
+
+def test_columns_must_have_the_same_length():
+    with pytest.raises(ValueError):
+        jlrpy.RouteTrace([1.0, 2.0], [1.0], [0.0, 1.0])
@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+
+import jlrpy
+from conftest import EMAIL, PASSWORD
+from mock_server import MockJLRServer
+
+
+class FailingRouteStore(jlrpy.RouteStore):
+    """Route store refusing to store the route of one trip"""
+
+    def __init__(self, path, failing_trip):
+        super().__init__(path)
+        self.failing_trip = failing_trip
+
+    def put(self, vin, trip_id, route):
+        if trip_id == self.failing_trip:
+            raise sqlite3.OperationalError("database is locked")
+        super().put(vin, trip_id, route)
+
+
+def test_download_routes(tmp_path):
+    store = jlrpy.RouteStore(str(tmp_path / "routes.db"))
+    with MockJLRServer(route_points=50) as server:
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, route_store=store) as c:
+            vehicle = c.vehicles[0]
+            assert vehicle.download_routes([1, 2, 3]) == {}
+            requests_made = server.endpoint_counts["route"]
+            assert vehicle.download_routes([1, 2, 3]) == {}
+            assert server.endpoint_counts["route"] == requests_made
+            assert len(vehicle.get_route(2)["waypoints"]) == 50
+
+
+def test_download_routes_isolates_failures(tmp_path):
+    store = FailingRouteStore(str(tmp_path / "routes.db"), failing_trip=2)
+    with MockJLRServer(route_points=50) as server:
+        with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, route_store=store) as c:
+            vehicle = c.vehicles[0]
+            get_trip = vehicle.get_trip
+            vehicle.get_trip = lambda trip_id, *args: None if trip_id == 3 else get_trip(trip_id, *args)
+            errors = vehicle.download_routes([1, 2, 3])
+            assert set(errors) == {2, 3}
+            assert isinstance(errors[2], sqlite3.OperationalError)
+            assert isinstance(errors[3], jlrpy.APIError)
+            assert store.cached(vehicle.vin, [1, 2, 3]) == {"1"}
+            vehicle.get_trip = get_trip
+            store.failing_trip = None
+            assert vehicle.download_routes([1, 2, 3]) == {}
+    assert store.cached(vehicle.vin, [1, 2, 3]) == {"1", "2", "3"}
+
+
+def test_async_download_routes_isolates_failures(tmp_path):
+    store = FailingRouteStore(str(tmp_path / "routes.db"), failing_trip=2)
+
+    async def main(server):
+        async with jlrpy.AsyncConnection(EMAIL, PASSWORD, base_urls=server.base_urls, route_store=store) as c:
+            vehicle = c.vehicles[0]
+            get_trip = vehicle.get_trip
+
+            async def patched(trip_id, *args):
+                return None if trip_id == 3 else await get_trip(trip_id, *args)
+
+            vehicle.get_trip = patched
+            errors = await vehicle.download_routes([1, 2, 3])
+            assert set(errors) == {2, 3}
+            assert store.cached(vehicle.vin, [1, 2, 3]) == {"1"}
+            vehicle.get_trip = get_trip
+            store.failing_trip = None
+            assert await vehicle.download_routes([1, 2, 3]) == {}
+            return vehicle.vin
+
+    with MockJLRServer(route_points=50) as server:
+        vin = asyncio.run(main(server))
+    assert store.cached(vin, [1, 2, 3]) == {"1", "2", "3"}
@@ -0,0 +1,28 @@
+import os
+import stat
+
+import pytest
+
+import jlrpy
+
+
+@pytest.mark.parametrize("store_class", [jlrpy.FileSessionStore, jlrpy.SqliteSessionStore])
+def test_round_trip(store_class, tmp_path):
+    store = store_class(str(tmp_path / "sessions"))
+    assert store.load("key") is None
+    store.save("key", {"access_token": "token"})
+    assert store.load("key") == {"access_token": "token"}
+    store.delete("key")
+    assert store.load("key") is None
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+@pytest.mark.parametrize("store_class", [jlrpy.FileSessionStore, jlrpy.SqliteSessionStore])
+def test_owner_only_permissions(store_class, tmp_path):
+    path = tmp_path / "sessions"
+    old_umask = os.umask(0o022)
+    try:
+        store_class(str(path)).save("key", {"access_token": "token"})
+    finally:
+        os.umask(old_umask)
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
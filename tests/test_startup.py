@@ -0,0 +1,26 @@
+import jlrpy
+from conftest import EMAIL, PASSWORD
+
+
+def test_lazy_connection_calls(server):
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, lazy=True) as c:
+        assert server.request_count == 0
+        assert c.get_user_info()["userId"]
+        assert c.reverse_geocode(51.5, -0.1) is not None
+        assert len(c.vehicles) == 2
+
+
+def test_lazy_vehicle_calls(server):
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, lazy=True) as c:
+        assert c.vehicles[0].get_status() is not None
+
+
+def test_resume_skips_login(server, tmp_path):
+    store = jlrpy.FileSessionStore(str(tmp_path / "sessions.json"))
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, session_store=store):
+        pass
+    logins = server.endpoint_counts.get("tokens", 0)
+    with jlrpy.Connection(EMAIL, PASSWORD, base_urls=server.base_urls, session_store=store, lazy=True) as c:
+        assert c.get_user_info()["userId"]
+    assert server.endpoint_counts.get("tokens", 0) == logins
+
@@ -0,0 +1,60 @@
+import jlrpy
+
+
+def status(alerts=(), updated="2020-05-18T10:30:03+0000", **values):
+    return {"vehicleStatus": {"coreStatus": [{"key": key, "value": value} for key, value in values.items()]},
+            "vehicleAlerts": [{"key": key, "active": active} for key, active in alerts],
+            "lastUpdatedTime": updated}
+
+
+def test_first_status_is_the_baseline():
+    watcher = jlrpy.StatusWatcher()
+    assert watcher.update("VIN", status(DOOR_IS_ALL_DOORS_LOCKED="TRUE")) == []
+
+
+def test_reports_changed_added_and_removed_keys():
+    watcher = jlrpy.StatusWatcher()
+    watcher.update("VIN", status(DOOR_IS_ALL_DOORS_LOCKED="TRUE", ODOMETER_METER="1000"))
+    changes = watcher.update("VIN", status(updated="2020-05-18T11:30:03+0000", DOOR_IS_ALL_DOORS_LOCKED="FALSE",
+                                           EV_STATE_OF_CHARGE="64"))
+    assert {(c.key, c.old, c.new) for c in changes} == {("DOOR_IS_ALL_DOORS_LOCKED", "TRUE", "FALSE"),
+                                                        ("EV_STATE_OF_CHARGE", None, "64"),
+                                                        ("ODOMETER_METER", "1000", None)}
+    assert all(c.vin == "VIN" and c.last_updated.hour == 11 for c in changes)
+    assert watcher.update("VIN", status(DOOR_IS_ALL_DOORS_LOCKED="FALSE", EV_STATE_OF_CHARGE="64")) == []
+
+
+def test_alerts_and_key_filter():
+    watcher = jlrpy.StatusWatcher(keys=["alert:TYRE_PRESSURE", "EV_STATE_OF_CHARGE"])
+    watcher.update("VIN", status(EV_STATE_OF_CHARGE="60", ODOMETER_METER="1000"))
+    changes = watcher.update("VIN", status(alerts=[("TYRE_PRESSURE", True)], EV_STATE_OF_CHARGE="60",
+                                           ODOMETER_METER="2000"))
+    assert [(c.key, c.old, c.new) for c in changes] == [("alert:TYRE_PRESSURE", None, True)]
+
+
+def test_subscribers_and_vehicles_are_independent():
+    watcher = jlrpy.StatusWatcher()
+    seen, everything = [], []
+    watcher.subscribe(lambda change: seen.append(change.key), keys=["EV_STATE_OF_CHARGE"])
+    watcher.subscribe(everything.append)
+    watcher.subscribe(lambda change: 1 / 0)
+    for vin in ("A", "B"):
+        watcher.update(vin, status(EV_STATE_OF_CHARGE="60", ODOMETER_METER="1000"))
+    watcher.update("A", status(EV_STATE_OF_CHARGE="61", ODOMETER_METER="1001"))
+    assert seen == ["EV_STATE_OF_CHARGE"]
+    assert {change.vin for change in everything} == {"A"} and len(everything) == 2
+    watcher.forget("B")
+    assert watcher.update("B", status(EV_STATE_OF_CHARGE="70")) == []
+
+
+def test_observe_mock_server_status(server, connection):
+    watcher = jlrpy.StatusWatcher()
+    vehicle = connection.vehicles[0]
+    watcher.observe(vehicle, vehicle.get_status(structured=True))
+    assert watcher.update(vehicle.vin, vehicle.get_status()) == []
+    changed = vehicle.get_status()
+    for entry in changed["vehicleStatus"]["evStatus"]:
+        if entry["key"] == "EV_STATE_OF_CHARGE":
+            entry["value"] = "65"
+    changes = watcher.update(vehicle.vin, changed)
+    assert [(c.key, c.old, c.new) for c in changes] == [("EV_STATE_OF_CHARGE", "64", "65")]